@@ -0,0 +1,70 @@
+from sqlalchemy import case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import User, Post, Like, Comment, Story, StoryView, Conversation, Message, Notification, Hashtag, followers_table, post_hashtags_table
+
+# Contadores desnormalizados (User.followers_count, Post.likes_count, ...).
+# São mantidos pelos endpoints de escrita com UPDATE ... SET n = n + 1 atômico,
+# e podem ser recalculados em lote com `python counters.py`.
+
+async def increment(db: AsyncSession, column, row_id: int, delta: int = 1):
+    """UPDATE atômico de um contador: SET column = column + delta WHERE id = row_id"""
+    model = column.class_
+    await db.execute(update(model).where(model.id == row_id).values({column: column + delta}))
+
+async def decrement(db: AsyncSession, column, row_id: int, delta: int = 1):
+    await increment(db, column, row_id, -delta)
+
+def unread_column(conversation: Conversation, user_id: int):
+    """Contador de mensagens não lidas do participante user_id na conversa"""
+    return Conversation.user1_unread_count if conversation.user1_id == user_id else Conversation.user2_unread_count
+
+def _unread_messages(user_column):
+    return select(func.count(Message.id)).where(
+        Message.conversation_id == Conversation.id,
+        Message.receiver_id == user_column,
+        Message.is_read == False
+    )
+
+def _counter_updates():
+    """Pares (coluna, subquery correlacionada que recalcula o valor)"""
+    return [
+        (User.followers_count, select(func.count()).select_from(followers_table).where(followers_table.c.followed_id == User.id)),
+        (User.following_count, select(func.count()).select_from(followers_table).where(followers_table.c.follower_id == User.id)),
+        (User.posts_count, select(func.count(Post.id)).where(Post.author_id == User.id)),
+        (Post.likes_count, select(func.count(Like.id)).where(Like.post_id == Post.id)),
+        (Post.comments_count, select(func.count(Comment.id)).where(Comment.post_id == Post.id)),
+        (Story.views_count, select(func.count(StoryView.id)).where(StoryView.story_id == Story.id)),
+        (Hashtag.posts_count, select(func.count()).select_from(post_hashtags_table).where(post_hashtags_table.c.hashtag_id == Hashtag.id)),
+        (User.unread_notifications_count, select(func.count(Notification.id)).where(Notification.receiver_id == User.id, Notification.is_read == False)),
+        (Conversation.user1_unread_count, _unread_messages(Conversation.user1_id)),
+        (Conversation.user2_unread_count, _unread_messages(Conversation.user2_id)),
+        # Não são contadores, mas são desnormalizados do mesmo jeito (última mensagem da conversa)
+        (Conversation.last_message_id, select(func.max(Message.id)).where(Message.conversation_id == Conversation.id)),
+        (Conversation.last_message_preview, select(
+            case((Message.message_type == "image", "Photo"), else_=func.substr(func.coalesce(Message.content, ""), 1, 100))
+        ).where(Message.id == Conversation.last_message_id)),
+    ]
+
+def reconcile_counters(db: Session):
+    """Recalcula todos os contadores em lote (um UPDATE por coluna) e retorna as linhas alteradas"""
+    changed = {}
+    for column, recount in _counter_updates():
+        model = column.class_
+        recount = recount.scalar_subquery()
+        result = db.execute(
+            update(model).where(column.is_distinct_from(recount)).values({column: recount})
+            .execution_options(synchronize_session=False)
+        )
+        changed[f"{model.__tablename__}.{column.key}"] = result.rowcount
+    db.commit()
+    return changed
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        for name, count in reconcile_counters(db).items():
+            print(f"{name}: {count} linhas corrigidas")
+    finally:
+        db.close()
@@ -0,0 +1,71 @@
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from models import Post, Like, followers_table
+
+# Camada de consulta do feed: carrega uma página de posts com autor e mídias
+# e calcula is_liked com uma única consulta para a página inteira, em um número
+# fixo de idas ao banco independente do tamanho da página. likes_count e
+# comments_count são colunas desnormalizadas de Post (ver counters.py).
+
+def following_ids_subquery(user_id: int):
+    """Subquery com os IDs dos usuários seguidos (sem carregar a relação em Python)"""
+    return select(followers_table.c.followed_id).where(followers_table.c.follower_id == user_id)
+
+def feed_authors_filter(user_id: int):
+    """Filtro dos posts que aparecem no feed: próprios posts + posts de quem o usuário segue"""
+    return or_(
+        Post.author_id == user_id,
+        Post.author_id.in_(following_ids_subquery(user_id))
+    )
+
+def post_media_options():
+    """Opções de eager loading de autor, imagens e vídeos de um Post"""
+    return (
+        joinedload(Post.author),
+        selectinload(Post.images),
+        selectinload(Post.videos)
+    )
+
+def with_post_media(query):
+    """Aplica eager loading de autor, imagens e vídeos a uma query de Post"""
+    return query.options(*post_media_options())
+
+async def attach_post_stats(db: AsyncSession, posts, viewer_id: int):
+    """Preenche is_liked para uma lista de posts com uma consulta restrita aos IDs da página"""
+    if not posts:
+        return posts
+
+    post_ids = [post.id for post in posts]
+
+    liked_ids = set(await db.scalars(select(Like.post_id).where(
+        Like.post_id.in_(post_ids),
+        Like.user_id == viewer_id
+    )))
+
+    for post in posts:
+        post.is_liked = post.id in liked_ids
+
+    return posts
+
+async def load_posts(db: AsyncSession, query, viewer_id: int):
+    """Executa um select de Post (já filtrado, ordenado e paginado) e anexa os dados extras"""
+    posts = (await db.scalars(with_post_media(query))).unique().all()
+    return await attach_post_stats(db, posts, viewer_id)
+
+async def load_posts_by_ids(db: AsyncSession, post_ids, viewer_id: int):
+    """Carrega posts pelos IDs preservando a ordem recebida"""
+    if not post_ids:
+        return []
+    posts = await load_posts(db, select(Post).where(Post.id.in_(post_ids)), viewer_id)
+    by_id = {post.id: post for post in posts}
+    return [by_id[post_id] for post_id in post_ids if post_id in by_id]
+
+async def load_post(db: AsyncSession, post_id: int, viewer_id: int):
+    """Carrega um único post com os dados extras, ou None se não existir"""
+    posts = await load_posts(
+        db,
+        select(Post).where(Post.id == post_id).execution_options(populate_existing=True),
+        viewer_id
+    )
+    return posts[0] if posts else None
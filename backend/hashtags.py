@@ -0,0 +1,77 @@
+import re
+from sqlalchemy import select, update, delete, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import dialect_insert
+from models import Hashtag, post_hashtags_table
+from search import index_hashtags
+from trending import record_hashtag_activity
+
+# Manutenção das hashtags de um post em lote: um número fixo de comandos por
+# post, qualquer que seja a quantidade de tags na legenda, e posts_count sempre
+# com UPDATE atômico (n = n ± 1), sem ler-modificar-gravar.
+
+HASHTAG_PATTERN = re.compile(r'#(\w+)')
+
+def extract_hashtag_names(caption: str):
+    """Nomes em minúsculas, sem repetição, na ordem da legenda"""
+    if not caption:
+        return []
+    return list(dict.fromkeys(HASHTAG_PATTERN.findall(caption.lower())))
+
+async def sync_post_hashtags(db: AsyncSession, post_id: int, names) -> list:
+    """Deixa o post associado exatamente às hashtags em names e retorna essas hashtags.
+
+    Serve para post novo, edição de legenda (associa as novas, desassocia as que
+    saíram) e exclusão do post (names vazio). Não faz commit.
+    """
+    names = list(dict.fromkeys(name.lower() for name in names))
+    current = set((await db.scalars(
+        select(Hashtag.name).join(post_hashtags_table, post_hashtags_table.c.hashtag_id == Hashtag.id)
+        .where(post_hashtags_table.c.post_id == post_id)
+    )).all())
+    added = [name for name in names if name not in current]
+    removed = [name for name in current if name not in names]
+
+    if added:
+        existing = set((await db.scalars(select(Hashtag.name).where(Hashtag.name.in_(added)))).all())
+        missing = [name for name in added if name not in existing]
+        if missing:
+            # ON CONFLICT cobre outro post criando a mesma tag ao mesmo tempo;
+            # RETURNING traz só as linhas que esta transação inseriu
+            insert = dialect_insert(db)
+            created = (await db.execute(
+                insert(Hashtag).values([{"name": name, "posts_count": 0} for name in missing])
+                .on_conflict_do_nothing(index_elements=[Hashtag.name])
+                .returning(Hashtag.id, Hashtag.name)
+            )).all()
+            await index_hashtags(db, created)
+
+        await db.execute(post_hashtags_table.insert().from_select(
+            ["post_id", "hashtag_id"],
+            select(literal(post_id), Hashtag.id).where(Hashtag.name.in_(added))
+        ))
+        await db.execute(
+            update(Hashtag).where(Hashtag.name.in_(added))
+            .values(posts_count=Hashtag.posts_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+    if removed:
+        removed_ids = select(Hashtag.id).where(Hashtag.name.in_(removed))
+        await db.execute(delete(post_hashtags_table).where(
+            post_hashtags_table.c.post_id == post_id,
+            post_hashtags_table.c.hashtag_id.in_(removed_ids)
+        ))
+        await db.execute(
+            update(Hashtag).where(Hashtag.name.in_(removed))
+            .values(posts_count=Hashtag.posts_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+
+    if not names:
+        return []
+    hashtags = (await db.scalars(
+        select(Hashtag).where(Hashtag.name.in_(names)).execution_options(populate_existing=True)
+    )).all()
+    await record_hashtag_activity(db, [hashtag.id for hashtag in hashtags if hashtag.name in added])
+    return hashtags
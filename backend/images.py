@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+from sqlalchemy import select, update
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models import MediaBlob, PostImage, Story
+from uploads import media_url
+from response_cache import invalidate, post_key
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Derivados de imagem gerados em segundo plano depois de create_post/create_story:
+# para cada largura de IMAGE_VARIANT_WIDTHS grava um JPEG e um WebP ao lado do
+# original (<sha256>_w640.jpg / .webp), já rotacionados e sem EXIF. O trabalho de
+# decodificar e redimensionar roda num pool de processos, fora do event loop e do GIL.
+
+IMAGE_DERIVATIVES_ENABLED = os.getenv("IMAGE_DERIVATIVES_ENABLED", "true").lower() == "true"
+IMAGE_VARIANT_WIDTHS = [int(width) for width in os.getenv("IMAGE_VARIANT_WIDTHS", "320,640,1080").split(",")]
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# GIFs ficam de fora para não perder a animação
+RESIZABLE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'webp']
+
+_image_executor = None
+
+def get_image_executor() -> ProcessPoolExecutor:
+    """Pool criado no primeiro uso. Com spawn os processos começam de um
+    interpretador limpo, sem herdar o event loop, as conexões do banco e as
+    threads do servidor (o fork copiaria esse estado)."""
+    global _image_executor
+    if _image_executor is None:
+        _image_executor = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _image_executor
+
+def variant_path(path: str, width: int, extension: str) -> str:
+    return f"{os.path.splitext(path)[0]}_w{width}.{extension}"
+
+def _save_atomic(image, path: str, format: str, **options):
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    image.save(temp_path, format, **options)
+    os.replace(temp_path, path)
+
+def make_variants(path: str):
+    """Gera os derivados de uma imagem (roda no pool de processos) e retorna [(largura, jpeg, webp)]"""
+    variants = []
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        # Nunca amplia: larguras maiores que o original viram o próprio original
+        for width in sorted({min(width, image.width) for width in IMAGE_VARIANT_WIDTHS}):
+            jpeg_path = variant_path(path, width, "jpg")
+            webp_path = variant_path(path, width, "webp")
+            if not (os.path.exists(jpeg_path) and os.path.exists(webp_path)):
+                height = max(1, round(image.height * width / image.width))
+                resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                # Sem o parâmetro exif os metadados do original não são copiados
+                _save_atomic(resized.convert("RGB"), jpeg_path, "JPEG",
+                             quality=IMAGE_VARIANT_QUALITY, optimize=True, progressive=True)
+                _save_atomic(resized, webp_path, "WEBP", quality=IMAGE_VARIANT_QUALITY, method=4)
+            variants.append((width, jpeg_path, webp_path))
+    return variants
+
+def build_srcsets(variants):
+    """Retorna (srcset JPEG, srcset WebP) no formato do atributo HTML"""
+    jpeg = ", ".join(f"{media_url(jpeg_path)} {width}w" for width, jpeg_path, _ in variants)
+    webp = ", ".join(f"{media_url(webp_path)} {width}w" for width, _, webp_path in variants)
+    return jpeg, webp
+
+async def _compute_srcsets(rows):
+    """Gera os derivados de [(id, caminho)] fora de qualquer sessão do banco e
+    retorna {id: (srcset, webp_srcset)}"""
+    loop = asyncio.get_running_loop()
+    srcsets = {}
+    for row_id, path in rows:
+        if path.rsplit(".", 1)[-1].lower() not in RESIZABLE_EXTENSIONS:
+            continue
+        try:
+            variants = await loop.run_in_executor(get_image_executor(), make_variants, path)
+        except Exception:
+            # Sem derivados o cliente continua usando a imagem original
+            logger.exception("Falha ao gerar derivados de %s", path)
+            continue
+        srcsets[row_id] = build_srcsets(variants)
+    return srcsets
+
+async def _generate(model, query):
+    """Lê os caminhos numa sessão curta, gera os derivados e grava os srcsets
+    noutra: a conexão não fica presa enquanto as imagens são processadas"""
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(query)).all()
+    srcsets = await _compute_srcsets(rows)
+    if not srcsets:
+        return False
+    async with AsyncSessionLocal() as db:
+        for row_id, (srcset, webp_srcset) in srcsets.items():
+            await db.execute(
+                update(model).where(model.id == row_id).values(srcset=srcset, webp_srcset=webp_srcset)
+            )
+        await db.commit()
+    return True
+
+async def process_post_images(post_id: int):
+    """Tarefa de segundo plano de create_post"""
+    if not IMAGE_DERIVATIVES_ENABLED:
+        return
+    generated = await _generate(PostImage, (
+        select(PostImage.id, MediaBlob.path)
+        .join(MediaBlob, PostImage.blob_id == MediaBlob.id)
+        .where(PostImage.post_id == post_id)
+    ))
+    if generated:
+        await invalidate(post_key(post_id))
+
+async def process_story_image(story_id: int):
+    """Tarefa de segundo plano de create_story"""
+    if not IMAGE_DERIVATIVES_ENABLED:
+        return
+    await _generate(Story, (
+        select(Story.id, MediaBlob.path)
+        .join(MediaBlob, Story.blob_id == MediaBlob.id)
+        .where(Story.id == story_id)
+    ))
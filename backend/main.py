@@ -1,24 +1,51 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Response, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_, desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy import select, insert, update, delete, or_, and_
 from datetime import timedelta, datetime
-import shutil
+import asyncio
+import json
 import os
-from typing import List
-import uuid
-
-from database import SessionLocal, engine, get_db
-from models import Base, User, Post, Like, Comment, Story, StoryView, Conversation, Message, Notification, Hashtag, PostImage, PostVideo
-from schemas import UserCreate, UserLogin, Token, PostCreate, CommentCreate, User as UserSchema, Post as PostSchema, Comment as CommentSchema, UserProfile, StoryCreate, Story as StorySchema, StoryView as StoryViewSchema, MessageCreate, Message as MessageSchema, Conversation as ConversationSchema, Notification as NotificationSchema, Hashtag as HashtagSchema, PostImage as PostImageSchema, PostVideo as PostVideoSchema
-from auth import authenticate_user, create_access_token, get_current_active_user, get_password_hash, ACCESS_TOKEN_EXPIRE_MINUTES
+from typing import List, Optional
+
+from database import engine, get_async_db, get_async_read_db, AsyncSessionLocal
+from models import Base, followers_table, User, Post, Like, Comment, Story, StoryView, Conversation, Message, Notification, Hashtag, PostImage, PostVideo
+from schemas import UserCreate, UserLogin, Token, PostCreate, CommentCreate, User as UserSchema, Post as PostSchema, Comment as CommentSchema, UserProfile, StoryCreate, Story as StorySchema, StoryView as StoryViewSchema, StoryTrayItem, MessageCreate, Message as MessageSchema, Conversation as ConversationSchema, Notification as NotificationSchema, Hashtag as HashtagSchema, PostImage as PostImageSchema, PostVideo as PostVideoSchema, TrendingHashtag as TrendingHashtagSchema, TypeaheadResult
+from auth import authenticate_user, create_access_token, get_current_active_user, hash_password, user_from_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from feed import feed_authors_filter, following_ids_subquery, post_media_options, load_posts, load_posts_by_ids, load_post
+from pagination import paginate, set_next_cursor, NEXT_CURSOR_HEADER
+from counters import increment, decrement, unread_column
+from timeline import TIMELINE_ENABLED, fan_out_post, backfill_timeline, prune_timeline, timeline_page_ids, run_timeline_trimmer
+from uploads import UPLOAD_DIR, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, UploadSizeLimitMiddleware, file_extension, save_upload
+from media import register_blob
+from images import process_post_images, process_story_image
+from videos import enqueue_video_jobs
+from mediafiles import MediaFiles
+from notifications import enqueue_notification, run_dispatcher
+from realtime import hub, publish, next_event
+from search import create_search_index, index_user, find_users, find_hashtags
+from hashtags import extract_hashtag_names, sync_post_hashtags
+from typeahead import warm_up, run_refresher, add_user, add_hashtag, complete
+from trending import trending, run_trending_refresher
+from response_cache import response_cache, cached, invalidate, post_key, user_key, hashtag_key
+from stories import active_stories, add_story, mark_seen, live_story_ids, seen_story_ids, story_tray, ensure_active_stories, run_story_index_refresher
+from story_sweeper import STORY_SWEEPER_ENABLED, run_story_sweeper
 
 # Criar tabelas
 Base.metadata.create_all(bind=engine)
+create_search_index(engine)
 
 app = FastAPI(title="Instagram Clone API", version="1.0.0")
 
+# Quantas mensagens GET /conversations/{id}/messages marcou como lidas
+MARKED_READ_HEADER = "X-Marked-Read"
+
+# Uploads grandes demais são recusados antes do parse do multipart (uploads.py);
+# adicionado antes do CORS para que o 413 também leve os cabeçalhos de CORS
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -26,62 +53,144 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, MARKED_READ_HEADER],
 )
 
 # Servir arquivos estáticos
-os.makedirs("uploads", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+app.mount("/uploads", MediaFiles(directory=UPLOAD_DIR), name="uploads")
+
+# Dispatcher do outbox de notificações (notifications.py)
+@app.on_event("startup")
+async def start_notification_dispatcher():
+    app.state.notification_dispatcher = asyncio.create_task(run_dispatcher())
+
+@app.on_event("shutdown")
+async def stop_notification_dispatcher():
+    app.state.notification_dispatcher.cancel()
+
+@app.on_event("startup")
+async def start_timeline_trimmer():
+    app.state.timeline_trimmer = None
+    if TIMELINE_ENABLED:
+        app.state.timeline_trimmer = asyncio.create_task(run_timeline_trimmer())
+
+@app.on_event("shutdown")
+async def stop_timeline_trimmer():
+    if app.state.timeline_trimmer:
+        app.state.timeline_trimmer.cancel()
+
+@app.on_event("startup")
+async def start_typeahead():
+    await warm_up()
+    app.state.typeahead_refresher = asyncio.create_task(run_refresher())
+
+@app.on_event("shutdown")
+async def stop_typeahead():
+    app.state.typeahead_refresher.cancel()
+
+@app.on_event("startup")
+async def start_trending():
+    app.state.trending_refresher = asyncio.create_task(run_trending_refresher())
+
+@app.on_event("shutdown")
+async def stop_trending():
+    app.state.trending_refresher.cancel()
+
+@app.on_event("startup")
+async def start_story_index():
+    app.state.story_index_refresher = asyncio.create_task(run_story_index_refresher())
+
+@app.on_event("shutdown")
+async def stop_story_index():
+    app.state.story_index_refresher.cancel()
+
+@app.on_event("startup")
+async def start_story_sweeper():
+    app.state.story_sweeper = None
+    if STORY_SWEEPER_ENABLED:
+        app.state.story_sweeper = asyncio.create_task(run_story_sweeper(on_archived=active_stories.remove))
+
+@app.on_event("shutdown")
+async def stop_story_sweeper():
+    if app.state.story_sweeper:
+        app.state.story_sweeper.cancel()
+
+# Com AsyncSession não há lazy loading: as relações serializadas nas respostas
+# são carregadas explicitamente com as opções abaixo.
+def message_options():
+    return (selectinload(Message.sender), selectinload(Message.receiver))
+
+def conversation_options():
+    # Tudo num único SELECT com joins: o custo não depende do histórico de mensagens
+    return (
+        joinedload(Conversation.user1),
+        joinedload(Conversation.user2),
+        joinedload(Conversation.last_message).options(
+            joinedload(Message.sender),
+            joinedload(Message.receiver)
+        )
+    )
 
-# Função para criar notificações
-def create_notification(db: Session, receiver_id: int, sender_id: int, notification_type: str, message: str, related_post_id: int = None, related_comment_id: int = None):
-    if receiver_id == sender_id:
-        return  # Não criar notificação para si mesmo
+def notification_options():
+    return (
+        selectinload(Notification.sender),
+        selectinload(Notification.related_post).options(*post_media_options())
+    )
 
-    notification = Notification(
-        receiver_id=receiver_id,
-        sender_id=sender_id,
-        notification_type=notification_type,
-        message=message,
-        related_post_id=related_post_id,
-        related_comment_id=related_comment_id
+async def load_conversation(db: AsyncSession, conversation_id: int):
+    return await db.scalar(
+        select(Conversation).where(Conversation.id == conversation_id)
+        .options(*conversation_options()).execution_options(populate_existing=True)
     )
-    db.add(notification)
-    db.commit()
-    return notification
 
-# Função para processar hashtags
-def process_hashtags(db: Session, post: Post):
-    hashtag_names = post.extract_hashtags()
+async def load_message(db: AsyncSession, message_id: int):
+    return await db.scalar(
+        select(Message).where(Message.id == message_id)
+        .options(*message_options()).execution_options(populate_existing=True)
+    )
+
+MESSAGE_PREVIEW_LENGTH = 100
 
-    for hashtag_name in hashtag_names:
-        # Buscar ou criar hashtag
-        hashtag = db.query(Hashtag).filter(Hashtag.name == hashtag_name).first()
-        if not hashtag:
-            hashtag = Hashtag(name=hashtag_name, posts_count=0)
-            db.add(hashtag)
-            db.flush()  # Para obter o ID
+def set_last_message(conversation: Conversation, message: Message):
+    """Atualiza a última mensagem desnormalizada e a atividade da conversa (message já com id)"""
+    conversation.last_message_id = message.id
+    if message.message_type == "image":
+        conversation.last_message_preview = "Photo"
+    else:
+        conversation.last_message_preview = (message.content or "")[:MESSAGE_PREVIEW_LENGTH]
+    conversation.updated_at = datetime.utcnow()
 
-        # Associar hashtag ao post se ainda não estiver associada
-        if hashtag not in post.hashtags:
-            post.hashtags.append(hashtag)
-            hashtag.posts_count += 1
+async def find_conversation(db: AsyncSession, user_id: int, other_user_id: int):
+    return await db.scalar(select(Conversation).where(
+        or_(
+            and_(Conversation.user1_id == user_id, Conversation.user2_id == other_user_id),
+            and_(Conversation.user1_id == other_user_id, Conversation.user2_id == user_id)
+        )
+    ))
 
-    db.commit()
+# Função para processar hashtags
+async def process_hashtags(db: AsyncSession, post: Post):
+    hashtags = await sync_post_hashtags(db, post.id, extract_hashtag_names(post.caption))
+    await db.commit()
+    await invalidate(*(hashtag_key(hashtag.name) for hashtag in hashtags))
+    for hashtag in hashtags:
+        add_hashtag(hashtag)
 
 # Auth endpoints
 @app.post("/auth/register", response_model=UserSchema)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Verificar se usuário já existe
-    db_user = db.query(User).filter(User.username == user.username).first()
+    db_user = await db.scalar(select(User).where(User.username == user.username))
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    
-    db_user = db.query(User).filter(User.email == user.email).first()
+
+    db_user = await db.scalar(select(User).where(User.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    
+
     # Criar novo usuário
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     db_user = User(
         username=user.username,
         email=user.email,
@@ -90,13 +199,16 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.flush()
+    await index_user(db, db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    add_user(db_user)
     return db_user
 
 @app.post("/auth/login", response_model=Token)
-async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
-    user = authenticate_user(db, user_credentials.username, user_credentials.password)
+async def login(user_credentials: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, user_credentials.username, user_credentials.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -105,10 +217,15 @@ async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username}, expires_delta=access_token_expires, user_id=user.id
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+# Métricas do cache de respostas em memória
+@app.get("/metrics/cache")
+async def get_cache_metrics(current_user: User = Depends(get_current_active_user)):
+    return {"response_cache": response_cache.stats()}
+
 # User endpoints
 @app.get("/users/me", response_model=UserSchema)
 async def read_users_me(current_user: User = Depends(get_current_active_user)):
@@ -116,79 +233,95 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
 
 @app.get("/users/{username}", response_model=UserProfile)
 async def get_user_profile(
-    username: str, 
-    db: Session = Depends(get_db),
+    username: str,
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
+    async def load():
+        user = await db.scalar(select(User).where(User.username == username))
+        return UserProfile.model_validate(user).model_dump(mode="json", exclude={"is_following"}) if user else None
+
+    # Corpo compartilhado em cache (response_cache.py); is_following é uma busca pela PK
+    profile = await cached(user_key(username), load)
+    if profile is None:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    followers_count = len(user.followers)
-    following_count = len(user.following)
-    posts_count = len(user.posts)
-    is_following = current_user in user.followers
-    
-    return UserProfile(
-        **user.__dict__,
-        followers_count=followers_count,
-        following_count=following_count,
-        posts_count=posts_count,
-        is_following=is_following
-    )
+
+    return {**profile, "is_following": await is_following(db, current_user.id, profile["id"])}
+
+async def is_following(db: AsyncSession, follower_id: int, followed_id: int) -> bool:
+    row = await db.execute(select(followers_table.c.follower_id).where(
+        followers_table.c.follower_id == follower_id,
+        followers_table.c.followed_id == followed_id
+    ))
+    return row.first() is not None
 
 # Follow/Unfollow
 @app.post("/users/{username}/follow")
 async def follow_user(
     username: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    user_to_follow = db.query(User).filter(User.username == username).first()
+    user_to_follow = await db.scalar(select(User).where(User.username == username))
     if not user_to_follow:
         raise HTTPException(status_code=404, detail="User not found")
 
     if user_to_follow == current_user:
         raise HTTPException(status_code=400, detail="Cannot follow yourself")
 
-    if current_user not in user_to_follow.followers:
-        user_to_follow.followers.append(current_user)
-        db.commit()
-
-        # Criar notificação
-        create_notification(
+    if not await is_following(db, current_user.id, user_to_follow.id):
+        await db.execute(insert(followers_table).values(
+            follower_id=current_user.id,
+            followed_id=user_to_follow.id
+        ))
+        await increment(db, User.followers_count, user_to_follow.id)
+        await increment(db, User.following_count, current_user.id)
+        await backfill_timeline(db, current_user.id, user_to_follow.id)
+
+        # Criar notificação (entregue pelo dispatcher após o commit)
+        enqueue_notification(
             db=db,
             receiver_id=user_to_follow.id,
             sender_id=current_user.id,
             notification_type="follow",
             message=f"{current_user.username} started following you"
         )
+        await db.commit()
+        await invalidate(user_key(user_to_follow.username), user_key(current_user.username))
 
     return {"message": "User followed successfully"}
 
 @app.delete("/users/{username}/follow")
 async def unfollow_user(
     username: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    user_to_unfollow = db.query(User).filter(User.username == username).first()
+    user_to_unfollow = await db.scalar(select(User).where(User.username == username))
     if not user_to_unfollow:
         raise HTTPException(status_code=404, detail="User not found")
 
-    if current_user in user_to_unfollow.followers:
-        user_to_unfollow.followers.remove(current_user)
-        db.commit()
+    if await is_following(db, current_user.id, user_to_unfollow.id):
+        await db.execute(delete(followers_table).where(
+            followers_table.c.follower_id == current_user.id,
+            followers_table.c.followed_id == user_to_unfollow.id
+        ))
+        await decrement(db, User.followers_count, user_to_unfollow.id)
+        await decrement(db, User.following_count, current_user.id)
+        await prune_timeline(db, current_user.id, user_to_unfollow.id)
+        await db.commit()
+        await invalidate(user_key(user_to_unfollow.username), user_key(current_user.username))
 
     return {"message": "User unfollowed successfully"}
 
 # Post endpoints
 @app.post("/posts", response_model=PostSchema)
 async def create_post(
+    background_tasks: BackgroundTasks,
     caption: str = Form(""),
     images: List[UploadFile] = File(None),
     videos: List[UploadFile] = File(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
     # Verificar se há pelo menos uma mídia
@@ -199,145 +332,140 @@ async def create_post(
     if total_media > 10:
         raise HTTPException(status_code=400, detail="Maximum 10 media files allowed")
 
+    # Validar formatos antes de criar o post
+    for image in images or []:
+        if file_extension(image) not in IMAGE_EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"Unsupported image format: {file_extension(image)}")
+    for video in videos or []:
+        if file_extension(video) not in VIDEO_EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"Unsupported video format: {file_extension(video)}")
+
+    # Gravar as mídias antes de tocar no banco: um upload recusado não deixa post
+    # pela metade (arquivos já gravados ficam para o coletor de media.py)
+    stored_images = [await save_upload(image, "image") for image in images or []]
+    stored_videos = [await save_upload(video, "video") for video in videos or []]
+
     # Criar post
     db_post = Post(
         caption=caption,
         author_id=current_user.id
     )
     db.add(db_post)
-    db.commit()
-    db.refresh(db_post)
+    await increment(db, User.posts_count, current_user.id)
+    await db.flush()
 
     media_index = 0
 
-    # Salvar imagens
-    if images:
-        for image in images:
-            file_extension = image.filename.split(".")[-1].lower()
-            if file_extension not in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-                raise HTTPException(status_code=400, detail=f"Unsupported image format: {file_extension}")
-
-            filename = f"post_{db_post.id}_{media_index}_{uuid.uuid4()}.{file_extension}"
-            file_path = f"uploads/{filename}"
-
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(image.file, buffer)
-
-            # Criar registro da imagem
-            post_image = PostImage(
-                post_id=db_post.id,
-                image_url=f"/uploads/{filename}",
-                order_index=media_index
-            )
-            db.add(post_image)
-            media_index += 1
-
-    # Salvar vídeos
-    if videos:
-        for video in videos:
-            file_extension = video.filename.split(".")[-1].lower()
-            if file_extension not in ['mp4', 'mov', 'avi', 'mkv', 'webm']:
-                raise HTTPException(status_code=400, detail=f"Unsupported video format: {file_extension}")
-
-            filename = f"post_{db_post.id}_{media_index}_{uuid.uuid4()}.{file_extension}"
-            file_path = f"uploads/{filename}"
-
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(video.file, buffer)
-
-            # Criar registro do vídeo
-            post_video = PostVideo(
-                post_id=db_post.id,
-                video_url=f"/uploads/{filename}",
-                order_index=media_index
-            )
-            db.add(post_video)
-            media_index += 1
-
-    # Para compatibilidade, definir image_url
-    if images:
-        db_post.image_url = f"/uploads/post_{db_post.id}_0_{uuid.uuid4().hex[:8]}.{images[0].filename.split('.')[-1]}"
-
-    db.commit()
-    db.refresh(db_post)
+    # Registrar imagens
+    for stored in stored_images:
+        blob = await register_blob(db, stored)
+        db.add(PostImage(
+            post_id=db_post.id,
+            image_url=blob.url,
+            blob_id=blob.id,
+            order_index=media_index
+        ))
+
+        # Para compatibilidade, image_url aponta para a primeira imagem
+        if media_index == 0:
+            db_post.image_url = blob.url
+        media_index += 1
+
+    # Registrar vídeos
+    post_videos = []
+    for stored in stored_videos:
+        blob = await register_blob(db, stored)
+        post_video = PostVideo(
+            post_id=db_post.id,
+            video_url=blob.url,
+            blob_id=blob.id,
+            order_index=media_index
+        )
+        db.add(post_video)
+        post_videos.append(post_video)
+        media_index += 1
+
+    # Poster e duração dos vídeos ficam com o worker (videos.py)
+    await db.flush()
+    enqueue_video_jobs(db, db_post, post_videos)
+
+    await db.commit()
 
     # Processar hashtags
-    process_hashtags(db, db_post)
+    await process_hashtags(db, db_post)
 
-    # Adicionar dados extras
-    db_post.author = current_user
-    db_post.likes_count = 0
-    db_post.comments_count = 0
-    db_post.is_liked = False
-    db_post.has_videos = db_post.has_videos
-    db_post.media_type = db_post.media_type
+    # Distribuir para as timelines dos seguidores (modo materializado)
+    await fan_out_post(db, db_post)
+    await db.commit()
+    await invalidate(user_key(current_user.username))
 
-    return db_post
+    # Miniaturas, WebP e tamanhos responsivos são gerados depois da resposta
+    if stored_images:
+        background_tasks.add_task(process_post_images, db_post.id)
+
+    return await load_post(db, db_post.id, current_user.id)
 
 @app.get("/posts", response_model=List[PostSchema])
 async def get_feed(
+    response: Response,
     skip: int = 0,
     limit: int = 20,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    # Buscar posts dos usuários seguidos + próprios posts
-    following_ids = [user.id for user in current_user.following]
-    following_ids.append(current_user.id)
-
-    posts = db.query(Post).filter(Post.author_id.in_(following_ids)).order_by(Post.created_at.desc()).offset(skip).limit(limit).all()
+    if TIMELINE_ENABLED:
+        # Leitura da timeline materializada + posts de celebridades
+        post_ids = await timeline_page_ids(db, current_user.id, skip, limit, cursor)
+        posts = await load_posts_by_ids(db, post_ids, current_user.id)
+        return set_next_cursor(response, posts, limit)
 
-    # Adicionar dados extras para cada post
-    for post in posts:
-        post.likes_count = len(post.likes)
-        post.comments_count = len(post.comments)
-        post.is_liked = any(like.user_id == current_user.id for like in post.likes)
-        post.primary_image_url = post.primary_image_url
-        post.has_videos = post.has_videos
-        post.media_type = post.media_type
+    # Buscar posts dos usuários seguidos + próprios posts
+    query = select(Post).where(feed_authors_filter(current_user.id))
+    query = paginate(query, Post, skip, limit, cursor)
 
-    return posts
+    posts = await load_posts(db, query, current_user.id)
+    return set_next_cursor(response, posts, limit)
 
 @app.get("/posts/{post_id}", response_model=PostSchema)
 async def get_post(
     post_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    post = db.query(Post).filter(Post.id == post_id).first()
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
+    async def load():
+        post = await load_post(db, post_id, current_user.id)
+        return PostSchema.model_validate(post).model_dump(mode="json", exclude={"is_liked"}) if post else None
 
-    post.likes_count = len(post.likes)
-    post.comments_count = len(post.comments)
-    post.is_liked = any(like.user_id == current_user.id for like in post.likes)
-    post.primary_image_url = post.primary_image_url
-    post.has_videos = post.has_videos
-    post.media_type = post.media_type
+    # Posts com vídeo em processamento mudam sem passar pela API (videos.py): não entram no cache
+    post = await cached(post_key(post_id), load, cacheable=lambda body: body["status"] == "ready")
+    if post is None:
+        raise HTTPException(status_code=404, detail="Post not found")
 
-    return post
+    liked = await db.scalar(select(Like.id).where(Like.user_id == current_user.id, Like.post_id == post_id).limit(1))
+    return {**post, "is_liked": liked is not None}
 
 # Like endpoints
 @app.post("/posts/{post_id}/like")
 async def like_post(
     post_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    post = db.query(Post).filter(Post.id == post_id).first()
+    post = await db.get(Post, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    existing_like = db.query(Like).filter(Like.user_id == current_user.id, Like.post_id == post_id).first()
+    existing_like = await db.scalar(select(Like).where(Like.user_id == current_user.id, Like.post_id == post_id))
     if existing_like:
         raise HTTPException(status_code=400, detail="Post already liked")
 
     like = Like(user_id=current_user.id, post_id=post_id)
     db.add(like)
-    db.commit()
+    await increment(db, Post.likes_count, post_id)
 
     # Criar notificação
-    create_notification(
+    enqueue_notification(
         db=db,
         receiver_id=post.author_id,
         sender_id=current_user.id,
@@ -345,21 +473,25 @@ async def like_post(
         message=f"{current_user.username} liked your post",
         related_post_id=post_id
     )
+    await db.commit()
+    await invalidate(post_key(post_id))
 
     return {"message": "Post liked successfully"}
 
 @app.delete("/posts/{post_id}/like")
 async def unlike_post(
     post_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    like = db.query(Like).filter(Like.user_id == current_user.id, Like.post_id == post_id).first()
+    like = await db.scalar(select(Like).where(Like.user_id == current_user.id, Like.post_id == post_id))
     if not like:
         raise HTTPException(status_code=404, detail="Like not found")
 
-    db.delete(like)
-    db.commit()
+    await db.delete(like)
+    await decrement(db, Post.likes_count, post_id)
+    await db.commit()
+    await invalidate(post_key(post_id))
 
     return {"message": "Post unliked successfully"}
 
@@ -368,10 +500,10 @@ async def unlike_post(
 async def create_comment(
     post_id: int,
     comment: CommentCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    post = db.query(Post).filter(Post.id == post_id).first()
+    post = await db.get(Post, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
@@ -381,11 +513,11 @@ async def create_comment(
         post_id=post_id
     )
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
+    await increment(db, Post.comments_count, post_id)
+    await db.flush()
 
     # Criar notificação
-    create_notification(
+    enqueue_notification(
         db=db,
         receiver_id=post.author_id,
         sender_id=current_user.id,
@@ -394,6 +526,9 @@ async def create_comment(
         related_post_id=post_id,
         related_comment_id=db_comment.id
     )
+    await db.commit()
+    await invalidate(post_key(post_id))
+    await db.refresh(db_comment, ["created_at"])
 
     db_comment.author = current_user
     return db_comment
@@ -401,106 +536,115 @@ async def create_comment(
 @app.get("/posts/{post_id}/comments", response_model=List[CommentSchema])
 async def get_comments(
     post_id: int,
+    response: Response,
     skip: int = 0,
     limit: int = 50,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    comments = db.query(Comment).filter(Comment.post_id == post_id).order_by(Comment.created_at.desc()).offset(skip).limit(limit).all()
-    return comments
+    query = select(Comment).where(Comment.post_id == post_id).options(selectinload(Comment.author))
+    comments = (await db.scalars(paginate(query, Comment, skip, limit, cursor))).all()
+    return set_next_cursor(response, comments, limit)
 
 # Story endpoints
 @app.post("/stories", response_model=StorySchema)
 async def create_story(
+    background_tasks: BackgroundTasks,
     text_content: str = Form(""),
     image: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
     # Salvar imagem
-    file_extension = image.filename.split(".")[-1]
-    filename = f"story_{uuid.uuid4()}.{file_extension}"
-    file_path = f"uploads/{filename}"
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(image.file, buffer)
+    stored = await save_upload(image, "image")
+    blob = await register_blob(db, stored)
 
     # Criar story
     db_story = Story(
         text_content=text_content,
-        image_url=f"/uploads/{filename}",
+        image_url=blob.url,
+        blob_id=blob.id,
         author_id=current_user.id,
         expires_at=datetime.utcnow() + timedelta(hours=24)
     )
     db.add(db_story)
-    db.commit()
-    db.refresh(db_story)
+    await db.commit()
+    await db.refresh(db_story, ["created_at"])
 
     # Adicionar dados extras
     db_story.author = current_user
-    db_story.views_count = 0
     db_story.is_viewed = False
-    db_story.is_expired = False
+    add_story(db_story)
+
+    background_tasks.add_task(process_story_image, db_story.id)
 
     return db_story
 
+async def load_live_stories(db: AsyncSession, author_ids, viewer_id: int):
+    """Stories vivas dos autores pelo índice em memória (stories.py), com is_viewed"""
+    await ensure_active_stories()
+    story_ids = live_story_ids(author_ids)
+    if not story_ids:
+        return []
+    stories = (await db.scalars(
+        select(Story).where(Story.id.in_(story_ids), Story.is_active == True)
+        .options(selectinload(Story.author)).order_by(Story.created_at.desc())
+    )).all()
+    seen = await seen_story_ids(db, viewer_id, story_ids)
+    for story in stories:
+        story.is_viewed = story.id in seen
+    return stories
+
+async def story_author_ids(db: AsyncSession, user_id: int):
+    """Próprio usuário + seguidos (busca pela PK de followers)"""
+    return [user_id] + list(await db.scalars(following_ids_subquery(user_id)))
+
 @app.get("/stories", response_model=List[StorySchema])
 async def get_stories(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    # Buscar stories dos usuários seguidos + próprios stories (não expirados)
-    following_ids = [user.id for user in current_user.following]
-    following_ids.append(current_user.id)
-
-    current_time = datetime.utcnow()
-    stories = db.query(Story).filter(
-        Story.author_id.in_(following_ids),
-        Story.expires_at > current_time,
-        Story.is_active == True
-    ).order_by(Story.created_at.desc()).all()
-
-    # Adicionar dados extras para cada story
-    for story in stories:
-        story.views_count = len(story.views)
-        story.is_expired = story.expires_at <= current_time
-        # Verificar se o usuário atual já viu este story
-        story.is_viewed = any(view.viewer_id == current_user.id for view in story.views)
+    # Stories dos usuários seguidos + próprios stories (não expirados)
+    return await load_live_stories(db, await story_author_ids(db, current_user.id), current_user.id)
 
-    return stories
+@app.get("/stories/tray", response_model=List[StoryTrayItem])
+async def get_story_tray(
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    # Bandeja agrupada por autor; as stories em si são pedidas ao abrir cada autor
+    await ensure_active_stories()
+    author_ids = await story_author_ids(db, current_user.id)
+    seen = await seen_story_ids(db, current_user.id, live_story_ids(author_ids))
+    tray = story_tray(author_ids, current_user.id, seen)
+    if not tray:
+        return []
+
+    authors = {user.id: user for user in (await db.scalars(
+        select(User).where(User.id.in_([item["author_id"] for item in tray]))
+    )).all()}
+    return [{**item, "author": authors[item["author_id"]]} for item in tray if item["author_id"] in authors]
 
 @app.get("/stories/user/{username}", response_model=List[StorySchema])
 async def get_user_stories(
     username: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    current_time = datetime.utcnow()
-    stories = db.query(Story).filter(
-        Story.author_id == user.id,
-        Story.expires_at > current_time,
-        Story.is_active == True
-    ).order_by(Story.created_at.desc()).all()
-
-    # Adicionar dados extras
-    for story in stories:
-        story.views_count = len(story.views)
-        story.is_expired = story.expires_at <= current_time
-        story.is_viewed = any(view.viewer_id == current_user.id for view in story.views)
-
-    return stories
+    return await load_live_stories(db, [user.id], current_user.id)
 
 @app.post("/stories/{story_id}/view")
 async def view_story(
     story_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    story = db.query(Story).filter(Story.id == story_id).first()
+    story = await db.get(Story, story_id)
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
 
@@ -508,25 +652,27 @@ async def view_story(
         raise HTTPException(status_code=400, detail="Story has expired")
 
     # Verificar se já visualizou
-    existing_view = db.query(StoryView).filter(
+    existing_view = await db.scalar(select(StoryView).where(
         StoryView.story_id == story_id,
         StoryView.viewer_id == current_user.id
-    ).first()
+    ))
 
     if not existing_view:
         view = StoryView(story_id=story_id, viewer_id=current_user.id)
         db.add(view)
-        db.commit()
+        await increment(db, Story.views_count, story_id)
+        await db.commit()
+    mark_seen(current_user.id, story_id)
 
     return {"message": "Story viewed successfully"}
 
 @app.get("/stories/{story_id}/views", response_model=List[StoryViewSchema])
 async def get_story_views(
     story_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    story = db.query(Story).filter(Story.id == story_id).first()
+    story = await db.get(Story, story_id)
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
 
@@ -534,55 +680,56 @@ async def get_story_views(
     if story.author_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to view story views")
 
-    views = db.query(StoryView).filter(StoryView.story_id == story_id).order_by(StoryView.viewed_at.desc()).all()
+    views = (await db.scalars(
+        select(StoryView).where(StoryView.story_id == story_id)
+        .options(selectinload(StoryView.viewer)).order_by(StoryView.viewed_at.desc())
+    )).all()
     return views
 
 # Direct Messages endpoints
 @app.get("/conversations", response_model=List[ConversationSchema])
 async def get_conversations(
-    db: Session = Depends(get_db),
+    response: Response,
+    skip: int = 0,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    conversations = db.query(Conversation).filter(
+    # Caixa de entrada: uma consulta paginada por (updated_at, id) com participantes e última mensagem
+    query = select(Conversation).where(
         or_(
             Conversation.user1_id == current_user.id,
             Conversation.user2_id == current_user.id
         )
-    ).order_by(desc(Conversation.updated_at)).all()
+    ).options(*conversation_options())
+    conversations = (await db.scalars(
+        paginate(query, Conversation, skip, limit, cursor, order_column=Conversation.updated_at)
+    )).unique().all()
 
-    # Adicionar dados extras para cada conversa
+    # Adicionar dados extras para cada conversa (sem consultas adicionais)
     for conv in conversations:
         conv.other_user = conv.get_other_user(current_user.id)
-        # Contar mensagens não lidas
-        conv.unread_count = db.query(Message).filter(
-            Message.conversation_id == conv.id,
-            Message.receiver_id == current_user.id,
-            Message.is_read == False
-        ).count()
+        conv.unread_count = conv.get_unread_count(current_user.id)
 
-    return conversations
+    return set_next_cursor(response, conversations, limit, order_attr="updated_at")
 
 @app.get("/conversations/{user_id}", response_model=ConversationSchema)
 async def get_or_create_conversation(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot create conversation with yourself")
 
     # Verificar se o usuário existe
-    other_user = db.query(User).filter(User.id == user_id).first()
+    other_user = await db.get(User, user_id)
     if not other_user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Buscar conversa existente
-    conversation = db.query(Conversation).filter(
-        or_(
-            and_(Conversation.user1_id == current_user.id, Conversation.user2_id == user_id),
-            and_(Conversation.user1_id == user_id, Conversation.user2_id == current_user.id)
-        )
-    ).first()
+    conversation = await find_conversation(db, current_user.id, user_id)
 
     # Criar nova conversa se não existir
     if not conversation:
@@ -591,79 +738,72 @@ async def get_or_create_conversation(
             user2_id=max(current_user.id, user_id)
         )
         db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
+        await db.commit()
+
+    conversation = await load_conversation(db, conversation.id)
 
     # Adicionar dados extras
     conversation.other_user = conversation.get_other_user(current_user.id)
-    conversation.unread_count = db.query(Message).filter(
-        Message.conversation_id == conversation.id,
-        Message.receiver_id == current_user.id,
-        Message.is_read == False
-    ).count()
+    conversation.unread_count = conversation.get_unread_count(current_user.id)
 
     return conversation
 
 @app.get("/conversations/{conversation_id}/messages", response_model=List[MessageSchema])
 async def get_messages(
     conversation_id: int,
+    response: Response,
     skip: int = 0,
     limit: int = 50,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
     # Verificar se o usuário faz parte da conversa
-    conversation = db.query(Conversation).filter(
+    conversation = await db.scalar(select(Conversation).where(
         Conversation.id == conversation_id,
         or_(
             Conversation.user1_id == current_user.id,
             Conversation.user2_id == current_user.id
         )
-    ).first()
+    ))
 
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    messages = db.query(Message).filter(
-        Message.conversation_id == conversation_id
-    ).order_by(desc(Message.created_at)).offset(skip).limit(limit).all()
+    query = select(Message).where(Message.conversation_id == conversation_id).options(*message_options())
+    messages = (await db.scalars(paginate(query, Message, skip, limit, cursor))).all()
+    set_next_cursor(response, messages, limit)
 
-    # Marcar mensagens como lidas
-    unread_messages = db.query(Message).filter(
+    # Marcar mensagens como lidas com um único UPDATE (índice parcial ix_messages_unread)
+    marked = (await db.execute(update(Message).where(
         Message.conversation_id == conversation_id,
         Message.receiver_id == current_user.id,
         Message.is_read == False
-    ).all()
-
-    for message in unread_messages:
-        message.is_read = True
+    ).values(is_read=True))).rowcount
 
-    if unread_messages:
-        db.commit()
+    if marked:
+        await decrement(db, unread_column(conversation, current_user.id), conversation.id, marked)
+        await db.commit()
+    response.headers[MARKED_READ_HEADER] = str(marked)
 
     return list(reversed(messages))  # Retornar em ordem cronológica
 
 @app.post("/messages", response_model=MessageSchema)
 async def send_message(
     message_data: MessageCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
     if message_data.receiver_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot send message to yourself")
 
     # Verificar se o receptor existe
-    receiver = db.query(User).filter(User.id == message_data.receiver_id).first()
+    receiver = await db.get(User, message_data.receiver_id)
     if not receiver:
         raise HTTPException(status_code=404, detail="Receiver not found")
 
     # Buscar ou criar conversa
-    conversation = db.query(Conversation).filter(
-        or_(
-            and_(Conversation.user1_id == current_user.id, Conversation.user2_id == message_data.receiver_id),
-            and_(Conversation.user1_id == message_data.receiver_id, Conversation.user2_id == current_user.id)
-        )
-    ).first()
+    conversation = await find_conversation(db, current_user.id, message_data.receiver_id)
 
     if not conversation:
         conversation = Conversation(
@@ -671,8 +811,7 @@ async def send_message(
             user2_id=max(current_user.id, message_data.receiver_id)
         )
         db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
+        await db.commit()
 
     # Criar mensagem
     message = Message(
@@ -683,15 +822,14 @@ async def send_message(
         message_type=message_data.message_type
     )
     db.add(message)
+    await db.flush()
 
-    # Atualizar timestamp da conversa
-    conversation.updated_at = datetime.utcnow()
-
-    db.commit()
-    db.refresh(message)
+    # Atualizar última mensagem e timestamp da conversa
+    set_last_message(conversation, message)
+    await increment(db, unread_column(conversation, message_data.receiver_id), conversation.id)
 
     # Criar notificação
-    create_notification(
+    enqueue_notification(
         db=db,
         receiver_id=message_data.receiver_id,
         sender_id=current_user.id,
@@ -699,38 +837,31 @@ async def send_message(
         message=f"{current_user.username} sent you a message"
     )
 
+    await db.commit()
+    message = await load_message(db, message.id)
+    await publish(message.receiver_id, "message", MessageSchema.model_validate(message).model_dump(mode="json"))
     return message
 
 @app.post("/messages/image", response_model=MessageSchema)
 async def send_image_message(
     receiver_id: int = Form(...),
     image: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
     if receiver_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot send message to yourself")
 
     # Verificar se o receptor existe
-    receiver = db.query(User).filter(User.id == receiver_id).first()
+    receiver = await db.get(User, receiver_id)
     if not receiver:
         raise HTTPException(status_code=404, detail="Receiver not found")
 
     # Salvar imagem
-    file_extension = image.filename.split(".")[-1]
-    filename = f"message_{uuid.uuid4()}.{file_extension}"
-    file_path = f"uploads/{filename}"
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(image.file, buffer)
+    stored = await save_upload(image, "image")
 
     # Buscar ou criar conversa
-    conversation = db.query(Conversation).filter(
-        or_(
-            and_(Conversation.user1_id == current_user.id, Conversation.user2_id == receiver_id),
-            and_(Conversation.user1_id == receiver_id, Conversation.user2_id == current_user.id)
-        )
-    ).first()
+    conversation = await find_conversation(db, current_user.id, receiver_id)
 
     if not conversation:
         conversation = Conversation(
@@ -738,138 +869,220 @@ async def send_image_message(
             user2_id=max(current_user.id, receiver_id)
         )
         db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
+        await db.commit()
 
     # Criar mensagem
+    blob = await register_blob(db, stored)
     message = Message(
         conversation_id=conversation.id,
         sender_id=current_user.id,
         receiver_id=receiver_id,
-        image_url=f"/uploads/{filename}",
+        image_url=blob.url,
+        blob_id=blob.id,
         message_type="image"
     )
     db.add(message)
+    await db.flush()
 
-    # Atualizar timestamp da conversa
-    conversation.updated_at = datetime.utcnow()
+    # Atualizar última mensagem e timestamp da conversa
+    set_last_message(conversation, message)
+    await increment(db, unread_column(conversation, receiver_id), conversation.id)
 
-    db.commit()
-    db.refresh(message)
+    await db.commit()
 
+    message = await load_message(db, message.id)
+    await publish(receiver_id, "message", MessageSchema.model_validate(message).model_dump(mode="json"))
     return message
 
 # Notifications endpoints
 @app.get("/notifications", response_model=List[NotificationSchema])
 async def get_notifications(
+    response: Response,
     skip: int = 0,
     limit: int = 50,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    notifications = db.query(Notification).filter(
+    query = select(Notification).where(
         Notification.receiver_id == current_user.id
-    ).order_by(desc(Notification.created_at)).offset(skip).limit(limit).all()
+    ).options(*notification_options())
+    notifications = (await db.scalars(paginate(query, Notification, skip, limit, cursor))).all()
 
-    return notifications
+    return set_next_cursor(response, notifications, limit)
 
 @app.get("/notifications/unread-count")
 async def get_unread_notifications_count(
-    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    count = db.query(Notification).filter(
-        Notification.receiver_id == current_user.id,
-        Notification.is_read == False
-    ).count()
-
-    return {"unread_count": count}
+    # Contador mantido pelo dispatcher de notificações e pelos endpoints de leitura;
+    # current_user já foi lido pela chave primária na autenticação
+    return {"unread_count": current_user.unread_notifications_count}
 
 @app.post("/notifications/{notification_id}/read")
 async def mark_notification_as_read(
     notification_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    notification = db.query(Notification).filter(
+    # UPDATE condicional: com duas requisições simultâneas só uma marca a
+    # notificação e decrementa o contador
+    marked = (await db.execute(update(Notification).where(
         Notification.id == notification_id,
-        Notification.receiver_id == current_user.id
-    ).first()
-
-    if not notification:
-        raise HTTPException(status_code=404, detail="Notification not found")
-
-    notification.is_read = True
-    db.commit()
+        Notification.receiver_id == current_user.id,
+        Notification.is_read == False
+    ).values(is_read=True))).rowcount
+
+    if marked:
+        await decrement(db, User.unread_notifications_count, current_user.id, marked)
+        await db.commit()
+    else:
+        exists = await db.scalar(select(Notification.id).where(
+            Notification.id == notification_id,
+            Notification.receiver_id == current_user.id
+        ))
+        if exists is None:
+            raise HTTPException(status_code=404, detail="Notification not found")
 
     return {"message": "Notification marked as read"}
 
 @app.post("/notifications/mark-all-read")
 async def mark_all_notifications_as_read(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    notifications = db.query(Notification).filter(
+    # Um único UPDATE sobre o índice parcial ix_notifications_unread
+    marked = (await db.execute(update(Notification).where(
         Notification.receiver_id == current_user.id,
         Notification.is_read == False
-    ).all()
-
-    for notification in notifications:
-        notification.is_read = True
-
-    db.commit()
-
-    return {"message": f"Marked {len(notifications)} notifications as read"}
+    ).values(is_read=True))).rowcount
+
+    if marked:
+        await decrement(db, User.unread_notifications_count, current_user.id, marked)
+    await db.commit()
+
+    return {"message": f"Marked {marked} notifications as read", "marked_count": marked}
+
+# Realtime endpoints
+async def realtime_user(token: str):
+    """Autentica a conexão pelo JWT da query string (WebSocket e EventSource não enviam cabeçalhos)"""
+    # Sessão curta: a conexão dura minutos e não deve segurar uma conexão do pool
+    async with AsyncSessionLocal() as db:
+        user = await user_from_token(db, token)
+    if user is None or not user.is_active:
+        return None
+    return user
+
+@app.websocket("/ws")
+async def realtime_websocket(websocket: WebSocket, token: str = ""):
+    user = await realtime_user(token)
+    if user is None:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    queue = hub.subscribe(user.id)
+
+    async def send_events():
+        while True:
+            event = await next_event(queue)
+            await websocket.send_json(event or {"type": "ping"})
+
+    # O envio roda em paralelo; este laço só lê para perceber a desconexão do cliente
+    sender = asyncio.create_task(send_events())
+    try:
+        while not sender.done():
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        hub.unsubscribe(user.id, queue)
+
+@app.get("/events")
+async def realtime_events(request: Request, token: str = ""):
+    """Mesmos eventos do /ws via Server-Sent Events"""
+    user = await realtime_user(token)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+
+    async def stream():
+        queue = hub.subscribe(user.id)
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                event = await next_event(queue)
+                if event is None:
+                    yield ": ping\n\n"
+                else:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            hub.unsubscribe(user.id, queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # Search endpoints
 @app.get("/search/users", response_model=List[UserSchema])
 async def search_users(
     q: str,
     limit: int = 20,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     if not q or len(q.strip()) < 2:
         return []
 
-    search_term = f"%{q.strip()}%"
-
-    users = db.query(User).filter(
-        or_(
-            User.username.ilike(search_term),
-            User.full_name.ilike(search_term)
-        ),
-        User.id != current_user.id  # Excluir o próprio usuário
-    ).limit(limit).all()
+    # Prefixo, substring e erros de digitação; ranking por relevância, seguidores e relação (search.py)
+    return await find_users(db, q.strip(), current_user.id, limit)
 
-    return users
+@app.get("/search/typeahead", response_model=TypeaheadResult)
+async def search_typeahead(
+    q: str,
+    limit: int = 10,
+    kind: str = "all",
+    current_user: User = Depends(get_current_active_user)
+):
+    # Autocomplete em memória (typeahead.py): nenhuma consulta ao banco por tecla
+    if kind not in ("all", "users", "hashtags"):
+        raise HTTPException(status_code=400, detail="kind must be all, users or hashtags")
+    return complete(q, limit, kind, current_user.id)
 
 @app.get("/search/hashtags", response_model=List[HashtagSchema])
 async def search_hashtags(
     q: str,
     limit: int = 20,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     if not q or len(q.strip()) < 1:
         return []
 
-    search_term = f"%{q.strip().lower()}%"
-
-    hashtags = db.query(Hashtag).filter(
-        Hashtag.name.ilike(search_term)
-    ).order_by(desc(Hashtag.posts_count)).limit(limit).all()
+    return await find_hashtags(db, q.strip(), limit)
 
-    return hashtags
+# Declarada antes de /hashtags/{hashtag_name}, que senão capturaria "trending"
+@app.get("/hashtags/trending", response_model=List[TrendingHashtagSchema])
+async def get_trending_hashtags(
+    limit: int = 10,
+    current_user: User = Depends(get_current_active_user)
+):
+    # Snapshot em memória recalculado periodicamente (trending.py)
+    return await trending(limit)
 
 @app.get("/hashtags/{hashtag_name}", response_model=HashtagSchema)
 async def get_hashtag(
     hashtag_name: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    hashtag = db.query(Hashtag).filter(Hashtag.name == hashtag_name.lower()).first()
-    if not hashtag:
+    async def load():
+        hashtag = await db.scalar(select(Hashtag).where(Hashtag.name == name))
+        return HashtagSchema.model_validate(hashtag).model_dump(mode="json") if hashtag else None
+
+    name = hashtag_name.lower()
+    hashtag = await cached(hashtag_key(name), load)
+    if hashtag is None:
         raise HTTPException(status_code=404, detail="Hashtag not found")
 
     return hashtag
@@ -877,38 +1090,22 @@ async def get_hashtag(
 @app.get("/hashtags/{hashtag_name}/posts", response_model=List[PostSchema])
 async def get_hashtag_posts(
     hashtag_name: str,
+    response: Response,
     skip: int = 0,
     limit: int = 20,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    hashtag = db.query(Hashtag).filter(Hashtag.name == hashtag_name.lower()).first()
+    hashtag = await db.scalar(select(Hashtag).where(Hashtag.name == hashtag_name.lower()))
     if not hashtag:
         raise HTTPException(status_code=404, detail="Hashtag not found")
 
-    posts = db.query(Post).join(Post.hashtags).filter(
-        Hashtag.id == hashtag.id
-    ).order_by(desc(Post.created_at)).offset(skip).limit(limit).all()
-
-    # Adicionar dados extras para cada post
-    for post in posts:
-        post.likes_count = len(post.likes)
-        post.comments_count = len(post.comments)
-        post.is_liked = any(like.user_id == current_user.id for like in post.likes)
-
-    return posts
-
-@app.get("/hashtags/trending", response_model=List[HashtagSchema])
-async def get_trending_hashtags(
-    limit: int = 10,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
-):
-    hashtags = db.query(Hashtag).filter(
-        Hashtag.posts_count > 0
-    ).order_by(desc(Hashtag.posts_count)).limit(limit).all()
+    query = select(Post).join(Post.hashtags).where(Hashtag.id == hashtag.id)
+    query = paginate(query, Post, skip, limit, cursor)
 
-    return hashtags
+    posts = await load_posts(db, query, current_user.id)
+    return set_next_cursor(response, posts, limit)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,128 @@
+import os
+import shutil
+import time
+from sqlalchemy import func, select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from database import SessionLocal, dialect_insert
+from models import MediaBlob, PostImage, PostVideo, Story, Message
+from uploads import MEDIA_DIR, StoredUpload
+
+load_dotenv()
+
+# Registro dos arquivos endereçados pelo conteúdo (ver uploads.py). Cada MediaBlob
+# guarda quantas linhas (PostImage, PostVideo, Story, Message) apontam para ele;
+# um upload repetido vira apenas refcount + 1. `python media.py` recalcula os
+# refcounts e apaga blobs e arquivos que não são mais referenciados.
+
+# Arquivos mais novos que isso nunca são apagados: podem pertencer a um upload
+# cujo registro ainda não foi confirmado no banco
+MEDIA_GC_GRACE_SECONDS = int(os.getenv("MEDIA_GC_GRACE_SECONDS", "3600"))
+
+async def register_blob(db: AsyncSession, stored: StoredUpload) -> MediaBlob:
+    """Cria o MediaBlob do arquivo ou incrementa o refcount do existente (upsert pelo sha256)"""
+    insert = dialect_insert(db)
+    await db.execute(
+        insert(MediaBlob)
+        .values(sha256=stored.sha256, path=stored.path, url=stored.url, size=stored.size, refcount=1)
+        .on_conflict_do_update(index_elements=[MediaBlob.sha256], set_={"refcount": MediaBlob.refcount + 1})
+    )
+    return await db.scalar(select(MediaBlob).where(MediaBlob.sha256 == stored.sha256))
+
+async def release_blob(db: AsyncSession, blob_id: int):
+    """Remove uma referência; o arquivo é apagado depois pelo coletor"""
+    await db.execute(update(MediaBlob).where(MediaBlob.id == blob_id).values(refcount=MediaBlob.refcount - 1))
+
+def _reference_counts():
+    return [
+        select(func.count(PostImage.id)).where(PostImage.blob_id == MediaBlob.id),
+        select(func.count(PostVideo.id)).where(PostVideo.blob_id == MediaBlob.id),
+        select(func.count(Story.id)).where(Story.blob_id == MediaBlob.id),
+        select(func.count(Message.id)).where(Message.blob_id == MediaBlob.id),
+    ]
+
+def _is_stale(path: str, now: float) -> bool:
+    try:
+        return now - os.path.getmtime(path) > MEDIA_GC_GRACE_SECONDS
+    except FileNotFoundError:
+        return True
+
+def collect_garbage(db: Session):
+    """Recalcula os refcounts e apaga blobs sem referência e arquivos órfãos em MEDIA_DIR"""
+    recount = sum(query.scalar_subquery() for query in _reference_counts())
+    fixed = db.execute(
+        update(MediaBlob).where(MediaBlob.refcount != recount).values(refcount=recount)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+    now = time.time()
+    unreferenced = db.execute(select(MediaBlob.id, MediaBlob.path).where(MediaBlob.refcount <= 0)).all()
+    removed_ids = [blob_id for blob_id, path in unreferenced if _is_stale(path, now)]
+    if removed_ids:
+        db.execute(delete(MediaBlob).where(MediaBlob.id.in_(removed_ids)).execution_options(synchronize_session=False))
+    db.commit()
+
+    # O original vive enquanto for o caminho de um blob; os derivados
+    # (<sha256>_w640.webp, ...) enquanto o blob de origem existir. Uma segunda
+    # cópia do mesmo conteúdo com outra extensão não é de ninguém.
+    blobs = db.execute(select(MediaBlob.sha256, MediaBlob.path)).all()
+    known_hashes = {sha256 for sha256, _ in blobs}
+    known_paths = {os.path.normpath(path) for _, path in blobs}
+    removed_files = 0
+    for root, _, files in os.walk(MEDIA_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            derivative = name[:64] in known_hashes and name[64:65] == "_"
+            if not derivative and os.path.normpath(path) not in known_paths and _is_stale(path, now):
+                os.remove(path)
+                removed_files += 1
+
+    return {"refcounts_fixed": fixed, "blobs_removed": len(removed_ids), "files_removed": removed_files}
+
+def reclaim_blobs(db: Session, blob_ids, cold_storage_dir: str = "") -> dict:
+    """Remove os blobs da lista que ficaram sem referência, com os arquivos derivados.
+
+    Com cold_storage_dir os arquivos são movidos para lá (mesma estrutura de
+    diretórios de MEDIA_DIR) em vez de apagados. Respeita MEDIA_GC_GRACE_SECONDS.
+    """
+    now = time.time()
+    rows = db.execute(
+        select(MediaBlob.id, MediaBlob.sha256, MediaBlob.path)
+        .where(MediaBlob.id.in_(list(blob_ids)), MediaBlob.refcount <= 0)
+    ).all()
+    rows = [row for row in rows if _is_stale(row.path, now)]
+    if rows:
+        db.execute(delete(MediaBlob).where(MediaBlob.id.in_([row.id for row in rows])).execution_options(synchronize_session=False))
+    db.commit()
+
+    # Arquivos só depois do commit: se algo falhar aqui, o coletor apaga os órfãos depois
+    removed_files = 0
+    reclaimed_bytes = 0
+    for row in rows:
+        directory = os.path.dirname(row.path)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if not name.startswith(row.sha256):
+                continue
+            path = os.path.join(directory, name)
+            size = os.path.getsize(path)
+            if cold_storage_dir:
+                target = os.path.join(cold_storage_dir, os.path.relpath(path, MEDIA_DIR))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            else:
+                os.remove(path)
+            removed_files += 1
+            reclaimed_bytes += size
+
+    return {"blobs_removed": len(rows), "files_removed": removed_files, "bytes_reclaimed": reclaimed_bytes}
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        for name, count in collect_garbage(db).items():
+            print(f"{name}: {count}")
+    finally:
+        db.close()
@@ -0,0 +1,145 @@
+import os
+import re
+import stat
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Servidor de /uploads. Os nomes de arquivo nunca são reaproveitados (sha256 do
+# conteúdo em uploads/media, uuid nos arquivos antigos), então as respostas são
+# imutáveis: Cache-Control longo com immutable, ETag forte derivado do nome,
+# 304 sem abrir o arquivo, Range de um intervalo (seek de vídeo), zero-copy
+# quando o servidor ASGI oferece a extensão, e o derivado WebP (images.py)
+# no lugar do derivado JPEG (_wN.jpg) quando o cliente aceita image/webp. O
+# original é sempre servido como foi enviado: não há WebP com a mesma resolução.
+
+MEDIA_CACHE_MAX_AGE = int(os.getenv("MEDIA_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+MEDIA_CACHE_CONTROL = f"public, max-age={MEDIA_CACHE_MAX_AGE}, immutable"
+
+NEGOTIABLE_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+# <sha256>_w640.jpg: derivado com um .webp de mesma largura ao lado
+DERIVATIVE_STEM = re.compile(r"_w\d+$")
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+def media_etag(full_path: str, stat_result: os.stat_result) -> str:
+    name = os.path.basename(full_path)
+    if os.path.sep + "media" + os.path.sep in full_path:
+        # Endereçado pelo conteúdo: o nome já identifica os bytes
+        return f'"{name}"'
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+def is_negotiable(path: str) -> bool:
+    stem, extension = os.path.splitext(path)
+    return extension.lower() in NEGOTIABLE_EXTENSIONS and DERIVATIVE_STEM.search(stem) is not None
+
+def parse_range(header: str, size: int):
+    """Intervalo (início, fim inclusivo) do cabeçalho Range.
+
+    Retorna None quando o cabeçalho deve ser ignorado (malformado ou com vários
+    intervalos: responde-se o arquivo inteiro) e levanta ValueError quando o
+    intervalo não pode ser atendido (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    first, last = first.strip(), last.strip()
+    if not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # bytes=-500: os últimos 500 bytes
+        if int(last) == 0:
+            raise ValueError("empty suffix range")
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+class MediaFileResponse(FileResponse):
+    """FileResponse com suporte a um intervalo de bytes e ao envio zero-copy"""
+
+    def __init__(self, *args, byte_range=None, **kwargs):
+        self.byte_range = byte_range
+        super().__init__(*args, **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        start, end = self.byte_range or (0, self.stat_result.st_size - 1)
+        remaining = end - start + 1
+        if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({"type": ZEROCOPY_EXTENSION, "file": file, "offset": start, "count": remaining})
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(start)
+            more_body = remaining > 0
+            if not more_body:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            while more_body:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                remaining -= len(chunk)
+                more_body = remaining > 0 and len(chunk) > 0
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+class MediaFiles(StaticFiles):
+    async def get_response(self, path: str, scope) -> Response:
+        accept = Headers(scope=scope).get("accept", "")
+        if scope["method"] in ("GET", "HEAD") and is_negotiable(path) and "image/webp" in accept:
+            full_path, stat_result = await run_in_threadpool(self.lookup_webp, path)
+            if stat_result:
+                return self.file_response(full_path, stat_result, scope)
+        return await super().get_response(path, scope)
+
+    def lookup_webp(self, path: str):
+        """Derivado WebP que substitui o arquivo pedido, ou (None, None)"""
+        full_path, stat_result = self.lookup_path(os.path.splitext(path)[0] + ".webp")
+        if stat_result and stat.S_ISREG(stat_result.st_mode):
+            return full_path, stat_result
+        return None, None
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        size = stat_result.st_size
+        etag = media_etag(str(full_path), stat_result)
+        headers = {
+            "cache-control": MEDIA_CACHE_CONTROL,
+            "etag": etag,
+            "accept-ranges": "bytes",
+        }
+        if is_negotiable(scope["path"]):
+            headers["vary"] = "Accept"
+
+        byte_range = None
+        range_header = request_headers.get("range")
+        if range_header and request_headers.get("if-range", etag) == etag:
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                return Response(status_code=416, headers={"content-range": f"bytes */{size}", **headers})
+        if byte_range:
+            status_code = 206
+            headers["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+            headers["content-length"] = str(byte_range[1] - byte_range[0] + 1)
+
+        response = MediaFileResponse(
+            full_path, status_code=status_code, headers=headers, stat_result=stat_result,
+            method=scope["method"], byte_range=byte_range
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
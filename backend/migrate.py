@@ -0,0 +1,96 @@
+from sqlalchemy import String, func, inspect, type_coerce, update
+from sqlalchemy.schema import CreateColumn
+from database import engine, SessionLocal
+from models import Base, Post, Comment, Conversation, Message, Notification, NotificationOutbox, TimelineEntry
+from counters import reconcile_counters
+from search import create_search_index
+
+# Atualização de um banco criado por uma versão anterior da API. O
+# Base.metadata.create_all do startup só cria tabelas que ainda não existem:
+# colunas e índices novos em tabelas antigas (users.followers_count,
+# posts.status, notifications.actor_count, ...) são adicionados aqui com
+# ALTER TABLE ... ADD COLUMN e CREATE INDEX. Depois os contadores e a última
+# mensagem das conversas são recalculados (counters.py), porque as colunas novas
+# nascem com o valor padrão, e o índice de busca é preenchido (search.py).
+#
+# Rodar com a API parada, uma vez por atualização: `python migrate.py`.
+# Repetir é seguro: só o que falta é criado.
+#
+# As datas usadas na paginação por cursor (pagination.py) passam a ser gravadas
+# sempre com microssegundos; no SQLite, as linhas antigas gravadas por
+# CURRENT_TIMESTAMP ("2024-01-01 12:00:00") ganham o ".000000" para que a
+# ordenação e a comparação com o cursor usem um único formato.
+#
+# Limitação: no SQLite, uma tabela stories já existente continua sem
+# AUTOINCREMENT (não há ALTER para isso); o id de uma story apagada pode ser
+# reaproveitado, o que o arquivamento de stories (story_sweeper.py) já tolera.
+
+def upgrade_schema(bind=engine) -> dict:
+    """Cria tabelas, colunas e índices que faltam; retorna o que foi criado"""
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    Base.metadata.create_all(bind=bind)
+
+    created = {"tables": [], "columns": [], "indexes": []}
+    preparer = bind.dialect.identifier_preparer
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                created["tables"].append(table.name)
+                continue
+
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                # Tipo, NOT NULL e DEFAULT do modelo; toda coluna NOT NULL nova tem server_default
+                definition = CreateColumn(column).compile(dialect=bind.dialect)
+                connection.exec_driver_sql(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {definition}")
+                created["columns"].append(f"{table.name}.{column.name}")
+
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    created["indexes"].append(index.name)
+    return created
+
+PAGINATED_TIMESTAMPS = (
+    Post.created_at, Comment.created_at, Conversation.created_at, Conversation.updated_at,
+    Message.created_at, Notification.created_at, NotificationOutbox.created_at,
+    TimelineEntry.created_at,
+)
+
+def normalize_timestamps(bind=engine) -> dict:
+    """Completa com microssegundos as datas gravadas sem fração no SQLite"""
+    fixed = {}
+    if bind.dialect.name != "sqlite":
+        return fixed
+    with bind.begin() as connection:
+        for column in PAGINATED_TIMESTAMPS:
+            result = connection.execute(
+                update(column.table)
+                .where(func.length(column) == 19)
+                .values({column.key: type_coerce(column, String).concat(".000000")})
+            )
+            fixed[f"{column.table.name}.{column.key}"] = result.rowcount
+    return fixed
+
+def migrate() -> dict:
+    created = upgrade_schema()
+    timestamps = normalize_timestamps()
+    create_search_index(engine)
+    db = SessionLocal()
+    try:
+        counters = reconcile_counters(db)
+    finally:
+        db.close()
+    counters = {**timestamps, **counters}
+    return {**created, "counters": {name: count for name, count in counters.items() if count}}
+
+if __name__ == "__main__":
+    report = migrate()
+    for name in ("tables", "columns", "indexes"):
+        print(f"{name}: {', '.join(report[name]) or '-'}")
+    for name, count in report["counters"].items():
+        print(f"{name}: {count} linhas corrigidas")
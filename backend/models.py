@@ -1,8 +1,7 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Table
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Table, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from datetime import datetime, timedelta
-import re
 from database import Base
 
 # Tabela de associação para seguidores
@@ -33,6 +32,12 @@ class User(Base):
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # Contadores desnormalizados (mantidos pelos endpoints, ver counters.py)
+    followers_count = Column(Integer, nullable=False, default=0, server_default="0")
+    following_count = Column(Integer, nullable=False, default=0, server_default="0")
+    posts_count = Column(Integer, nullable=False, default=0, server_default="0")
+    unread_notifications_count = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relacionamentos
     posts = relationship("Post", back_populates="author", cascade="all, delete-orphan")
@@ -69,12 +74,21 @@ class User(Base):
 
 class Post(Base):
     __tablename__ = "posts"
+    __table_args__ = (
+        Index("ix_posts_author_id_created_at", "author_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     caption = Column(Text, default="")
     image_url = Column(String, nullable=True)  # Para compatibilidade com posts antigos
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
     author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # processing enquanto houver vídeos aguardando o worker (videos.py), depois ready
+    status = Column(String, nullable=False, default="ready", server_default="ready")
+
+    # Contadores desnormalizados
+    likes_count = Column(Integer, nullable=False, default=0, server_default="0")
+    comments_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relacionamentos
     author = relationship("User", back_populates="posts")
@@ -84,13 +98,6 @@ class Post(Base):
     images = relationship("PostImage", back_populates="post", cascade="all, delete-orphan")
     videos = relationship("PostVideo", back_populates="post", cascade="all, delete-orphan")
 
-    def extract_hashtags(self):
-        """Extrai hashtags do caption do post"""
-        if not self.caption:
-            return []
-        hashtag_pattern = r'#(\w+)'
-        return re.findall(hashtag_pattern, self.caption.lower())
-
     @property
     def primary_image_url(self):
         """Retorna a URL da primeira imagem ou a image_url legacy"""
@@ -98,6 +105,19 @@ class Post(Base):
             return self.images[0].image_url
         return self.image_url
 
+    @property
+    def srcset(self):
+        """srcset da primeira imagem, quando os derivados já foram gerados"""
+        if self.images:
+            return self.images[0].srcset
+        return None
+
+    @property
+    def webp_srcset(self):
+        if self.images:
+            return self.images[0].webp_srcset
+        return None
+
     @property
     def has_videos(self):
         """Verifica se o post tem vídeos"""
@@ -113,12 +133,39 @@ class Post(Base):
         else:
             return "image"  # fallback para posts antigos
 
+class TimelineEntry(Base):
+    """Entrada da timeline materializada (fan-out on write) de um usuário"""
+    __tablename__ = "timeline_entries"
+    __table_args__ = (
+        Index("ix_timeline_entries_user_id_created_at", "user_id", "created_at", "post_id"),
+    )
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    post_id = Column(Integer, ForeignKey("posts.id"), primary_key=True)
+    author_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)  # created_at do post
+
+class MediaBlob(Base):
+    """Arquivo de mídia endereçado pelo conteúdo (sha256), compartilhado entre posts, stories e mensagens"""
+    __tablename__ = "media_blobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), unique=True, nullable=False)
+    path = Column(String, nullable=False)
+    url = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class PostImage(Base):
     __tablename__ = "post_images"
 
     id = Column(Integer, primary_key=True, index=True)
     post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)
     image_url = Column(String, nullable=False)
+    blob_id = Column(Integer, ForeignKey("media_blobs.id"), nullable=True, index=True)
+    srcset = Column(Text, nullable=True)  # derivados JPEG (images.py)
+    webp_srcset = Column(Text, nullable=True)
     order_index = Column(Integer, default=0)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -131,6 +178,7 @@ class PostVideo(Base):
     id = Column(Integer, primary_key=True, index=True)
     post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)
     video_url = Column(String, nullable=False)
+    blob_id = Column(Integer, ForeignKey("media_blobs.id"), nullable=True, index=True)
     thumbnail_url = Column(String, nullable=True)
     duration = Column(Integer, nullable=True)  # em segundos
     order_index = Column(Integer, default=0)
@@ -139,8 +187,29 @@ class PostVideo(Base):
     # Relacionamentos
     post = relationship("Post", back_populates="videos")
 
+class VideoJob(Base):
+    """Job da fila de pós-processamento de vídeo (poster e duração), consumida por videos.py"""
+    __tablename__ = "video_jobs"
+    __table_args__ = (
+        Index("ix_video_jobs_status_run_after", "status", "run_after"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    post_id = Column(Integer, ForeignKey("posts.id"), nullable=False, index=True)
+    post_video_id = Column(Integer, ForeignKey("post_videos.id"), nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+
 class Like(Base):
     __tablename__ = "likes"
+    __table_args__ = (
+        # is_liked de um post / da página do feed para quem está pedindo
+        Index("ix_likes_user_id_post_id", "user_id", "post_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -153,10 +222,13 @@ class Like(Base):
 
 class Comment(Base):
     __tablename__ = "comments"
+    __table_args__ = (
+        Index("ix_comments_post_id_created_at", "post_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(Text, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
     author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)
 
@@ -166,14 +238,24 @@ class Comment(Base):
 
 class Story(Base):
     __tablename__ = "stories"
+    __table_args__ = (
+        Index("ix_stories_expires_at", "expires_at"),
+        # Sem AUTOINCREMENT o SQLite reaproveita o id da última story apagada pelo
+        # sweeper; o índice de stories ativas depende de ids crescentes
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     image_url = Column(String, nullable=False)
+    blob_id = Column(Integer, ForeignKey("media_blobs.id"), nullable=True, index=True)
+    srcset = Column(Text, nullable=True)  # derivados JPEG (images.py)
+    webp_srcset = Column(Text, nullable=True)
     text_content = Column(Text, default="")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=False)
     author_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     is_active = Column(Boolean, default=True)
+    views_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relacionamentos
     author = relationship("User", back_populates="stories")
@@ -189,12 +271,12 @@ class Story(Base):
     def is_expired(self):
         return datetime.utcnow() > self.expires_at
 
-    @property
-    def views_count(self):
-        return len(self.views)
-
 class StoryView(Base):
     __tablename__ = "story_views"
+    __table_args__ = (
+        # "Já vi?" do viewer para um conjunto de stories, e a checagem de view_story
+        Index("ix_story_views_story_id_viewer_id", "story_id", "viewer_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     story_id = Column(Integer, ForeignKey("stories.id"), nullable=False)
@@ -205,31 +287,71 @@ class StoryView(Base):
     story = relationship("Story", back_populates="views")
     viewer = relationship("User", back_populates="story_views")
 
+class ArchivedStory(Base):
+    """Story expirada movida pelo sweeper (story_sweeper.py); story_id é o id original"""
+    __tablename__ = "archived_stories"
+
+    id = Column(Integer, primary_key=True)
+    story_id = Column(Integer, nullable=False, index=True)
+    author_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    image_url = Column(String, nullable=False)
+    text_content = Column(Text, default="")
+    views_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True))
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ArchivedStoryView(Base):
+    __tablename__ = "archived_story_views"
+
+    id = Column(Integer, primary_key=True)
+    archived_story_id = Column(Integer, ForeignKey("archived_stories.id"), nullable=False, index=True)
+    viewer_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    viewed_at = Column(DateTime(timezone=True))
+
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        Index("ix_conversations_user1_id_updated_at", "user1_id", "updated_at"),
+        Index("ix_conversations_user2_id_updated_at", "user2_id", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user1_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     user2_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+    # Última atividade (nova mensagem), definida pelos endpoints de envio; ordena a caixa de entrada.
+    # Sem onupdate: atualizar contadores ou last_message_id não deve reordenar as conversas.
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
+
+    # Última mensagem desnormalizada (mantida por send_message/send_image_message)
+    last_message_id = Column(Integer, ForeignKey("messages.id", use_alter=True, name="fk_conversations_last_message_id"), nullable=True)
+    last_message_preview = Column(String(200), nullable=True)
+
+    # Mensagens não lidas de cada participante (ver counters.py)
+    user1_unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+    user2_unread_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relacionamentos
     user1 = relationship("User", foreign_keys=[user1_id], back_populates="conversations_as_user1")
     user2 = relationship("User", foreign_keys=[user2_id], back_populates="conversations_as_user2")
-    messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
-
-    @property
-    def last_message(self):
-        if self.messages:
-            return max(self.messages, key=lambda m: m.created_at)
-        return None
+    messages = relationship("Message", back_populates="conversation", foreign_keys="Message.conversation_id", cascade="all, delete-orphan")
+    last_message = relationship("Message", foreign_keys=[last_message_id], post_update=True)
 
     def get_other_user(self, current_user_id):
         return self.user2 if self.user1_id == current_user_id else self.user1
 
+    def get_unread_count(self, current_user_id):
+        return self.user1_unread_count if self.user1_id == current_user_id else self.user2_unread_count
+
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_conversation_id_created_at", "conversation_id", "created_at"),
+        # Índice parcial: só as não lidas, alvo do UPDATE de marcar como lidas
+        Index("ix_messages_unread", "conversation_id", "receiver_id",
+              postgresql_where=text("is_read = false"), sqlite_where=text("is_read = 0")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
@@ -237,12 +359,13 @@ class Message(Base):
     receiver_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     content = Column(Text, nullable=True)
     image_url = Column(String, nullable=True)
+    blob_id = Column(Integer, ForeignKey("media_blobs.id"), nullable=True, index=True)
     message_type = Column(String, default="text")  # text, image
     is_read = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
 
     # Relacionamentos
-    conversation = relationship("Conversation", back_populates="messages")
+    conversation = relationship("Conversation", back_populates="messages", foreign_keys=[conversation_id])
     sender = relationship("User", foreign_keys=[sender_id], back_populates="sent_messages")
     receiver = relationship("User", foreign_keys=[receiver_id], back_populates="received_messages")
 
@@ -257,8 +380,24 @@ class Hashtag(Base):
     # Relacionamentos
     posts = relationship("Post", secondary=post_hashtags_table, back_populates="hashtags")
 
+class HashtagActivity(Base):
+    """Quantos posts usaram a hashtag numa janela de tempo (bucket), base do ranking de trending.py"""
+    __tablename__ = "hashtag_activity"
+    __table_args__ = (
+        Index("ix_hashtag_activity_bucket_start", "bucket_start"),
+    )
+
+    hashtag_id = Column(Integer, ForeignKey("hashtags.id"), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        Index("ix_notifications_receiver_id_created_at", "receiver_id", "created_at"),
+        Index("ix_notifications_unread", "receiver_id",
+              postgresql_where=text("is_read = false"), sqlite_where=text("is_read = 0")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     receiver_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -267,11 +406,33 @@ class Notification(Base):
     message = Column(Text, nullable=False)
     related_post_id = Column(Integer, ForeignKey("posts.id"), nullable=True)
     related_comment_id = Column(Integer, ForeignKey("comments.id"), nullable=True)
+    # Quantos usuários a notificação agrupa ("A and 12 others liked your post")
+    actor_count = Column(Integer, nullable=False, default=1, server_default="1")
     is_read = Column(Boolean, default=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
 
     # Relacionamentos
     receiver = relationship("User", foreign_keys=[receiver_id], back_populates="received_notifications")
     sender = relationship("User", foreign_keys=[sender_id], back_populates="sent_notifications")
     related_post = relationship("Post", foreign_keys=[related_post_id])
     related_comment = relationship("Comment", foreign_keys=[related_comment_id])
+
+class NotificationActor(Base):
+    """Usuários distintos agrupados numa notificação (base de actor_count)"""
+    __tablename__ = "notification_actors"
+
+    notification_id = Column(Integer, ForeignKey("notifications.id"), primary_key=True)
+    actor_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+
+class NotificationOutbox(Base):
+    """Notificação pendente, gravada na transação da ação e entregue pelo dispatcher (notifications.py)"""
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    receiver_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    sender_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    notification_type = Column(String, nullable=False)
+    message = Column(Text, nullable=False)
+    related_post_id = Column(Integer, ForeignKey("posts.id"), nullable=True)
+    related_comment_id = Column(Integer, ForeignKey("comments.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
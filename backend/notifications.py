@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, delete, desc, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from database import AsyncSessionLocal, dialect_insert
+from models import User, Notification, NotificationActor, NotificationOutbox
+from realtime import publish
+from counters import increment
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Outbox de notificações: os endpoints só gravam uma linha em notification_outbox
+# na mesma transação da ação (curtida, comentário, follow, mensagem). O dispatcher
+# roda em segundo plano no processo da API, acorda após o commit, espera uma
+# pequena janela para juntar rajadas e entrega o lote: insere as notificações de
+# uma vez e agrupa curtidas/follows numa notificação não lida recente
+# ("A and 12 others liked your post") em vez de criar uma linha por evento.
+# Os usuários agrupados ficam em notification_actors, então quem curte, descurte
+# e curte de novo não conta duas vezes. Cada lote é reivindicado com
+# DELETE ... RETURNING: com vários workers, um evento é entregue por um só.
+
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "500"))
+NOTIFICATION_BATCH_WINDOW_SECONDS = float(os.getenv("NOTIFICATION_BATCH_WINDOW_SECONDS", "0.2"))
+NOTIFICATION_DISPATCH_INTERVAL_SECONDS = float(os.getenv("NOTIFICATION_DISPATCH_INTERVAL_SECONDS", "5"))
+NOTIFICATION_COALESCE_WINDOW_MINUTES = int(os.getenv("NOTIFICATION_COALESCE_WINDOW_MINUTES", "60"))
+
+# Tipos agrupáveis e o verbo usado na mensagem agrupada
+COALESCED_TYPES = {
+    "like": "liked your post",
+    "follow": "started following you",
+}
+
+_wakeup = None  # asyncio.Event criado pelo dispatcher no loop da aplicação
+
+def enqueue_notification(db: AsyncSession, receiver_id: int, sender_id: int, notification_type: str, message: str, related_post_id: int = None, related_comment_id: int = None):
+    """Grava a notificação no outbox; ela é confirmada junto com o commit do chamador"""
+    if receiver_id == sender_id:
+        return  # Não criar notificação para si mesmo
+
+    db.add(NotificationOutbox(
+        receiver_id=receiver_id,
+        sender_id=sender_id,
+        notification_type=notification_type,
+        message=message,
+        related_post_id=related_post_id,
+        related_comment_id=related_comment_id
+    ))
+    db.sync_session.info["notification_outbox"] = True
+
+@event.listens_for(Session, "after_commit")
+def _wake_dispatcher(session):
+    if session.info.pop("notification_outbox", False) and _wakeup is not None:
+        _wakeup.set()
+
+@event.listens_for(Session, "after_rollback")
+def _forget_outbox(session):
+    session.info.pop("notification_outbox", None)
+
+def coalesced_message(username: str, actor_count: int, notification_type: str) -> str:
+    verb = COALESCED_TYPES[notification_type]
+    if actor_count <= 1:
+        return f"{username} {verb}"
+    others = actor_count - 1
+    return f"{username} and {others} {'other' if others == 1 else 'others'} {verb}"
+
+async def _add_actors(db: AsyncSession, notification_id: int, actor_ids) -> int:
+    """Registra os atores na notificação e retorna quantos ainda não estavam lá"""
+    insert_actors = dialect_insert(db)
+    added = await db.scalars(
+        insert_actors(NotificationActor)
+        .values([{"notification_id": notification_id, "actor_id": actor_id} for actor_id in actor_ids])
+        .on_conflict_do_nothing(index_elements=[NotificationActor.notification_id, NotificationActor.actor_id])
+        .returning(NotificationActor.actor_id)
+    )
+    return len(added.all())
+
+async def _coalesce(db: AsyncSession, key, events, usernames, rows_to_insert, new_actors):
+    """Agrupa os eventos numa notificação existente (retorna seus dados) ou numa nova linha de rows_to_insert"""
+    receiver_id, notification_type, related_post_id = key
+    # Remetentes distintos, do mais recente para o mais antigo
+    senders = list(dict.fromkeys(outbox_event.sender_id for outbox_event in reversed(events)))
+    latest = events[-1]
+
+    since = datetime.utcnow() - timedelta(minutes=NOTIFICATION_COALESCE_WINDOW_MINUTES)
+    existing = await db.scalar(
+        select(Notification).where(
+            Notification.receiver_id == receiver_id,
+            Notification.notification_type == notification_type,
+            Notification.related_post_id.is_(None) if related_post_id is None else Notification.related_post_id == related_post_id,
+            Notification.is_read == False,
+            Notification.created_at >= since
+        ).order_by(desc(Notification.created_at), desc(Notification.id)).limit(1)
+    )
+
+    if existing:
+        # Notificações anteriores à tabela de atores: o último remetente já está na contagem
+        if existing.sender_id is not None:
+            await _add_actors(db, existing.id, [existing.sender_id])
+        actor_count = existing.actor_count + await _add_actors(db, existing.id, senders)
+        existing.sender_id = senders[0]
+        existing.actor_count = actor_count
+        existing.message = coalesced_message(usernames[senders[0]], actor_count, notification_type)
+        existing.created_at = latest.created_at
+        return {
+            "receiver_id": receiver_id,
+            "sender_id": existing.sender_id,
+            "notification_type": notification_type,
+            "message": existing.message,
+            "related_post_id": related_post_id,
+            "actor_count": actor_count,
+        }
+
+    rows_to_insert.append({
+        "receiver_id": receiver_id,
+        "sender_id": senders[0],
+        "notification_type": notification_type,
+        "message": coalesced_message(usernames[senders[0]], len(senders), notification_type),
+        "related_post_id": related_post_id,
+        "related_comment_id": None,
+        "actor_count": len(senders),
+        "is_read": False,
+        "created_at": latest.created_at,
+    })
+    new_actors[len(rows_to_insert) - 1] = senders
+
+async def dispatch_outbox(db: AsyncSession) -> int:
+    """Entrega um lote do outbox numa única transação e retorna quantos eventos processou"""
+    # O lote é de quem conseguiu apagá-lo; no Postgres, SKIP LOCKED deixa os
+    # outros workers seguirem para as linhas seguintes em vez de esperar
+    batch = select(NotificationOutbox.id).order_by(NotificationOutbox.id).limit(
+        NOTIFICATION_BATCH_SIZE
+    ).with_for_update(skip_locked=True)
+    events = (await db.execute(
+        delete(NotificationOutbox).where(NotificationOutbox.id.in_(batch))
+        .returning(*NotificationOutbox.__table__.columns)
+        .execution_options(synchronize_session=False)
+    )).all()
+    if not events:
+        await db.commit()
+        return 0
+    events.sort(key=lambda outbox_event: outbox_event.id)
+
+    rows_to_insert = []
+    new_actors = {}  # posição em rows_to_insert -> remetentes agrupados
+    groups = {}
+    for outbox_event in events:
+        if outbox_event.notification_type in COALESCED_TYPES:
+            key = (outbox_event.receiver_id, outbox_event.notification_type, outbox_event.related_post_id)
+            groups.setdefault(key, []).append(outbox_event)
+        else:
+            rows_to_insert.append({
+                "receiver_id": outbox_event.receiver_id,
+                "sender_id": outbox_event.sender_id,
+                "notification_type": outbox_event.notification_type,
+                "message": outbox_event.message,
+                "related_post_id": outbox_event.related_post_id,
+                "related_comment_id": outbox_event.related_comment_id,
+                "actor_count": 1,
+                "is_read": False,
+                "created_at": outbox_event.created_at,
+            })
+
+    updated = []
+    if groups:
+        sender_ids = {outbox_event.sender_id for group in groups.values() for outbox_event in group}
+        usernames = dict((await db.execute(select(User.id, User.username).where(User.id.in_(sender_ids)))).all())
+        for key, group in groups.items():
+            coalesced = await _coalesce(db, key, group, usernames, rows_to_insert, new_actors)
+            if coalesced:
+                updated.append(coalesced)
+
+    if rows_to_insert:
+        notification_ids = (await db.scalars(
+            insert(Notification).returning(Notification.id, sort_by_parameter_order=True), rows_to_insert
+        )).all()
+        actor_rows = [
+            {"notification_id": notification_ids[position], "actor_id": actor_id}
+            for position, senders in new_actors.items() for actor_id in senders
+        ]
+        if actor_rows:
+            await db.execute(insert(NotificationActor), actor_rows)
+        # Contador de não lidas: só as linhas novas (o agrupamento reaproveita uma não lida)
+        new_per_receiver = Counter(row["receiver_id"] for row in rows_to_insert)
+        for receiver_id, count in new_per_receiver.items():
+            await increment(db, User.unread_notifications_count, receiver_id, count)
+    await db.commit()
+
+    # Push para as conexões abertas (realtime.py), só depois do commit
+    for row in rows_to_insert + updated:
+        await publish(row["receiver_id"], "notification", {
+            "notification_type": row["notification_type"],
+            "message": row["message"],
+            "sender_id": row["sender_id"],
+            "related_post_id": row["related_post_id"],
+            "actor_count": row["actor_count"],
+        })
+    return len(events)
+
+async def drain_outbox():
+    async with AsyncSessionLocal() as db:
+        while await dispatch_outbox(db) == NOTIFICATION_BATCH_SIZE:
+            pass
+
+async def run_dispatcher():
+    """Laço do dispatcher, iniciado no startup da aplicação"""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), NOTIFICATION_DISPATCH_INTERVAL_SECONDS)
+            # Janela curta para juntar a rajada num único lote
+            await asyncio.sleep(NOTIFICATION_BATCH_WINDOW_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            await drain_outbox()
+        except Exception:
+            # Os eventos continuam no outbox e são tentados de novo no próximo ciclo
+            logger.exception("Falha ao entregar notificações")
@@ -0,0 +1,75 @@
+import base64
+import binascii
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import HTTPException, Response
+from sqlalchemy import String, and_, or_, type_coerce
+from database import DATABASE_URL
+
+# Paginação por cursor (keyset) baseada em (created_at, id).
+# O cursor é opaco para o cliente: base64 de "<created_at ISO>|<id>".
+# O próximo cursor é devolvido no header X-Next-Cursor quando a página está cheia.
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+IS_SQLITE = "sqlite" in DATABASE_URL
+
+# Formato em que o tipo DateTime do SQLAlchemy grava datas no SQLite
+SQLITE_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _comparable(column, value: datetime):
+    """Normaliza a comparação de datas no SQLite.
+
+    No SQLite datas são texto e a comparação é lexicográfica. As colunas
+    usadas na paginação são sempre gravadas no formato do SQLAlchemy, com os
+    microssegundos (default=datetime.utcnow nos modelos; linhas antigas gravadas
+    por CURRENT_TIMESTAMP são convertidas pelo migrate.py), então o parâmetro é
+    formatado da mesma forma, inclusive com ".000000". O type_coerce não altera
+    o SQL gerado, então o índice continua sendo usado.
+    """
+    if not IS_SQLITE:
+        return column, value
+    value = value.replace(tzinfo=None)
+    return type_coerce(column, String), value.strftime(SQLITE_DATETIME_FORMAT)
+
+def keyset_filter(created_column, id_column, cursor: str):
+    """Filtro das linhas posteriores ao cursor na ordem (created_at DESC, id DESC)"""
+    created_at, row_id = decode_cursor(cursor)
+    column, value = _comparable(created_column, created_at)
+    return or_(
+        column < value,
+        and_(column == value, id_column < row_id)
+    )
+
+def paginate(query, model, skip: int, limit: int, cursor: Optional[str] = None, id_column=None, order_column=None):
+    """Ordena por (created_at, id) decrescente (ou order_column no lugar de created_at) e aplica cursor ou offset"""
+    if id_column is None:
+        id_column = model.id
+    if order_column is None:
+        order_column = model.created_at
+    if cursor:
+        query = query.where(keyset_filter(order_column, id_column, cursor))
+    query = query.order_by(order_column.desc(), id_column.desc())
+    if not cursor and skip:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+def set_next_cursor(response: Response, rows, limit: int, order_attr: str = "created_at"):
+    """Define o header X-Next-Cursor a partir da última linha de uma página cheia"""
+    if rows and len(rows) >= limit:
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(getattr(last, order_attr), last.id)
+    return rows
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Hub pub/sub de eventos em tempo real (mensagens e notificações) entregues por
+# WebSocket (/ws) e SSE (/events). Cada conexão assina o canal do seu usuário e
+# recebe os eventos por uma fila limitada. O LocalHub só alcança as conexões do
+# próprio processo; com REALTIME_BROKER_URL=redis://... o RedisHub repassa os
+# eventos pelo Redis, para que vários workers da API entreguem uns dos outros.
+
+REALTIME_BROKER_URL = os.getenv("REALTIME_BROKER_URL", "")
+REALTIME_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "100"))
+REALTIME_PING_SECONDS = float(os.getenv("REALTIME_PING_SECONDS", "25"))
+
+class LocalHub:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=REALTIME_QUEUE_SIZE)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def deliver(self, user_id: int, event: dict):
+        for queue in list(self._subscribers.get(user_id, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Cliente lento: o evento é descartado e ele ressincroniza pela API
+                pass
+
+    async def publish(self, user_id: int, event: dict):
+        self.deliver(user_id, event)
+
+    def stats(self):
+        return {
+            "users": len(self._subscribers),
+            "connections": sum(len(queues) for queues in self._subscribers.values()),
+        }
+
+class RedisHub(LocalHub):
+    """Publica no Redis; uma única assinatura por processo repassa às filas locais"""
+    CHANNEL_PREFIX = "realtime:user:"
+
+    def __init__(self, url: str):
+        super().__init__()
+        try:
+            import redis.asyncio as redis
+        except ImportError as error:
+            raise RuntimeError("REALTIME_BROKER_URL requer o pacote redis (pip install redis)") from error
+        self._redis = redis.from_url(url)
+        self._listener = None
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        return super().subscribe(user_id)
+
+    async def publish(self, user_id: int, event: dict):
+        await self._redis.publish(f"{self.CHANNEL_PREFIX}{user_id}", json.dumps(event))
+
+    async def _listen(self):
+        pubsub = self._redis.pubsub()
+        await pubsub.psubscribe(f"{self.CHANNEL_PREFIX}*")
+        async for item in pubsub.listen():
+            if item["type"] != "pmessage":
+                continue
+            user_id = int(item["channel"].decode().rsplit(":", 1)[-1])
+            self.deliver(user_id, json.loads(item["data"]))
+
+hub = RedisHub(REALTIME_BROKER_URL) if REALTIME_BROKER_URL else LocalHub()
+
+async def publish(user_id: int, event_type: str, data: dict):
+    """Publica um evento para todas as conexões do usuário; falhas do broker não afetam a requisição"""
+    try:
+        await hub.publish(user_id, {"type": event_type, "data": data})
+    except Exception:
+        logger.exception("Falha ao publicar evento %s", event_type)
+
+async def next_event(queue: asyncio.Queue):
+    """Próximo evento da fila, ou None se nada chegar dentro do intervalo de ping"""
+    try:
+        return await asyncio.wait_for(queue.get(), REALTIME_PING_SECONDS)
+    except asyncio.TimeoutError:
+        return None
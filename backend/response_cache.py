@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+from cache import TTLCache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Cache dos corpos de resposta das leituras mais quentes (perfil, post, hashtag).
+# O corpo guardado é o mesmo para todos os usuários; campos que dependem de quem
+# pede (is_liked, is_following) são calculados à parte com uma busca por índice e
+# aplicados sobre uma cópia. Os endpoints de escrita invalidam as chaves afetadas
+# depois do commit; o TTL limita o que escapar disso (ex.: alterações feitas por
+# outro worker quando o cache é local). Com RESPONSE_CACHE_URL=redis://... o
+# cache é compartilhado entre os workers e a invalidação vale para todos.
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "30"))
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "")
+
+class ResponseCache(ABC):
+    """Interface do cache: corpos JSON (dicts) por chave, com TTL"""
+
+    @abstractmethod
+    async def get(self, key: str):
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: dict):
+        ...
+
+    @abstractmethod
+    async def delete(self, *keys: str):
+        ...
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+class LocalResponseCache(ResponseCache):
+    """LRU com TTL na memória do processo"""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str):
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: dict):
+        self._cache.set(key, value)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._cache.delete(key)
+
+    def stats(self) -> dict:
+        return {"backend": "local", **self._cache.stats()}
+
+class RedisResponseCache(ResponseCache):
+    KEY_PREFIX = "response:"
+
+    def __init__(self, url: str, ttl: int = RESPONSE_CACHE_TTL):
+        try:
+            import redis.asyncio as redis
+        except ImportError as error:
+            raise RuntimeError("RESPONSE_CACHE_URL requer o pacote redis (pip install redis)") from error
+        self._redis = redis.from_url(url)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        raw = await self._redis.get(self.KEY_PREFIX + key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key: str, value: dict):
+        await self._redis.set(self.KEY_PREFIX + key, json.dumps(value), ex=self.ttl)
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._redis.delete(*(self.KEY_PREFIX + key for key in keys))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+response_cache = RedisResponseCache(RESPONSE_CACHE_URL) if RESPONSE_CACHE_URL else LocalResponseCache()
+
+def post_key(post_id: int) -> str:
+    return f"post:{post_id}"
+
+def user_key(username: str) -> str:
+    return f"user:{username}"
+
+def hashtag_key(name: str) -> str:
+    return f"hashtag:{name}"
+
+async def cached(key: str, load, cacheable=None):
+    """Corpo da chave no cache, ou o resultado de load() (dict ou None), guardado se cacheable(corpo)"""
+    try:
+        body = await response_cache.get(key)
+    except Exception:
+        logger.exception("Falha ao ler o cache de respostas")
+        body = None
+    if body is not None:
+        return body
+
+    body = await load()
+    if body is not None and (cacheable is None or cacheable(body)):
+        try:
+            await response_cache.set(key, body)
+        except Exception:
+            logger.exception("Falha ao gravar o cache de respostas")
+    return body
+
+async def invalidate(*keys: str):
+    """Chamado depois do commit da escrita; falhas do cache não afetam a requisição"""
+    try:
+        await response_cache.delete(*keys)
+    except Exception:
+        logger.exception("Falha ao invalidar o cache de respostas")
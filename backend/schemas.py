@@ -34,6 +34,8 @@ class UserProfile(User):
 # Post Image schemas
 class PostImageBase(BaseModel):
     image_url: str
+    srcset: Optional[str] = None
+    webp_srcset: Optional[str] = None
     order_index: int = 0
 
 class PostImage(PostImageBase):
@@ -78,8 +80,11 @@ class Post(PostBase):
     images: List[PostImage] = []
     videos: List[PostVideo] = []
     primary_image_url: Optional[str] = None
+    srcset: Optional[str] = None
+    webp_srcset: Optional[str] = None
     has_videos: bool = False
     media_type: str = "image"
+    status: str = "ready"
 
     class Config:
         from_attributes = True
@@ -121,6 +126,8 @@ class StoryCreate(StoryBase):
 class Story(StoryBase):
     id: int
     image_url: str
+    srcset: Optional[str] = None
+    webp_srcset: Optional[str] = None
     created_at: datetime
     expires_at: datetime
     author_id: int
@@ -133,6 +140,12 @@ class Story(StoryBase):
     class Config:
         from_attributes = True
 
+class StoryTrayItem(BaseModel):
+    author: User
+    story_ids: List[int]
+    has_unseen: bool
+    latest_story_at: datetime
+
 class StoryView(BaseModel):
     id: int
     story_id: int
@@ -178,6 +191,7 @@ class Conversation(ConversationBase):
     user1: User
     user2: User
     last_message: Optional[Message] = None
+    last_message_preview: Optional[str] = None
     unread_count: int = 0
     other_user: Optional[User] = None
 
@@ -195,6 +209,7 @@ class Notification(NotificationBase):
     sender_id: Optional[int] = None
     related_post_id: Optional[int] = None
     related_comment_id: Optional[int] = None
+    actor_count: int = 1
     is_read: bool
     created_at: datetime
     sender: Optional[User] = None
@@ -215,6 +230,9 @@ class Hashtag(HashtagBase):
     class Config:
         from_attributes = True
 
+class TrendingHashtag(Hashtag):
+    score: float = 0.0
+
 # Token schemas
 class Token(BaseModel):
     access_token: str
@@ -222,3 +240,19 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+
+# Typeahead schemas
+class TypeaheadUser(BaseModel):
+    id: int
+    username: str
+    full_name: str
+    profile_picture: Optional[str] = ""
+
+class TypeaheadHashtag(BaseModel):
+    id: int
+    name: str
+    posts_count: int
+
+class TypeaheadResult(BaseModel):
+    users: List[TypeaheadUser] = []
+    hashtags: List[TypeaheadHashtag] = []
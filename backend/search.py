@@ -0,0 +1,192 @@
+import logging
+import math
+import os
+from sqlalchemy import select, text, or_, and_, desc, func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from models import User, Hashtag, followers_table
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Busca de usuários e hashtags. O banco só recupera candidatos com um índice
+# adequado; o ranking final é feito aqui, igual para todos os backends:
+# similaridade por trigramas (tolera erros de digitação), bônus para prefixo,
+# popularidade (seguidores / posts) e relação com quem busca (segue / é seguido).
+#
+# Backends de recuperação (SEARCH_BACKEND=auto escolhe pelo banco):
+#   fts5    - SQLite: tabelas FTS5 com tokenizer trigram (users_fts, hashtags_fts),
+#             atualizadas no register e no process_hashtags
+#   trigram - Postgres: pg_trgm com índices GIN nas próprias colunas
+#   python  - qualquer banco: LIKE limitado e ranking em Python
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "50"))
+SEARCH_POPULARITY_WEIGHT = float(os.getenv("SEARCH_POPULARITY_WEIGHT", "0.05"))
+SEARCH_FOLLOWING_BONUS = float(os.getenv("SEARCH_FOLLOWING_BONUS", "0.3"))
+SEARCH_FOLLOWER_BONUS = float(os.getenv("SEARCH_FOLLOWER_BONUS", "0.15"))
+
+_backend = "python"
+
+def trigrams(value: str) -> set:
+    padded = f"  {value.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def similarity(query: str, value: str) -> float:
+    """Similaridade de Jaccard entre trigramas, como a similarity() do pg_trgm"""
+    if not value:
+        return 0.0
+    a, b = trigrams(query), trigrams(value)
+    return len(a & b) / len(a | b)
+
+def text_score(query: str, *values: str) -> float:
+    query = query.lower()
+    best = 0.0
+    for value in values:
+        if not value:
+            continue
+        score = similarity(query, value)
+        if value.lower().startswith(query):
+            score += 0.5
+        best = max(best, score)
+    return best
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _fts_query(query: str) -> str:
+    """Expressão MATCH com os trigramas da consulta em OR (rank = trigramas em comum)"""
+    terms = sorted(term for term in trigrams(query) if term.strip() == term)
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(username, full_name, tokenize='trigram')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS hashtags_fts USING fts5(name, tokenize='trigram')",
+    # Recupera linhas criadas antes do índice (ou por outro processo sem ele)
+    "INSERT INTO users_fts(rowid, username, full_name) SELECT id, username, full_name FROM users "
+    "WHERE id > (SELECT coalesce(max(rowid), 0) FROM users_fts)",
+    "INSERT INTO hashtags_fts(rowid, name) SELECT id, name FROM hashtags "
+    "WHERE id > (SELECT coalesce(max(rowid), 0) FROM hashtags_fts)",
+]
+
+_POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm ON users USING gin (username gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_full_name_trgm ON users USING gin (full_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_hashtags_name_trgm ON hashtags USING gin (name gin_trgm_ops)",
+]
+
+def create_search_index(engine) -> str:
+    """Cria/atualiza as estruturas de busca no startup e define o backend em uso"""
+    global _backend
+    dialect = engine.dialect.name
+    wanted = SEARCH_BACKEND
+    if wanted == "auto":
+        wanted = {"sqlite": "fts5", "postgresql": "trigram"}.get(dialect, "python")
+
+    ddl = {"fts5": _SQLITE_DDL, "trigram": _POSTGRES_DDL}.get(wanted)
+    if ddl:
+        try:
+            with engine.begin() as connection:
+                for statement in ddl:
+                    connection.execute(text(statement))
+        except SQLAlchemyError as error:
+            # Ex.: SQLite sem FTS5 ou usuário sem permissão para CREATE EXTENSION
+            logger.warning("Índice de busca %s indisponível, usando busca em Python: %s", wanted, error)
+            wanted = "python"
+    _backend = wanted
+    return _backend
+
+async def index_user(db: AsyncSession, user: User):
+    """Mantém o índice em dia com um novo usuário (mesma transação, após flush)"""
+    if _backend == "fts5":
+        await db.execute(
+            text("INSERT INTO users_fts(rowid, username, full_name) VALUES (:id, :username, :full_name)"),
+            {"id": user.id, "username": user.username, "full_name": user.full_name}
+        )
+
+async def index_hashtags(db: AsyncSession, hashtags):
+    """Hashtags recém-criadas (objetos ou linhas com id e name), num único executemany"""
+    if _backend == "fts5" and hashtags:
+        await db.execute(
+            text("INSERT INTO hashtags_fts(rowid, name) VALUES (:id, :name)"),
+            [{"id": hashtag.id, "name": hashtag.name} for hashtag in hashtags]
+        )
+
+async def _user_candidates(db: AsyncSession, query: str):
+    if _backend == "fts5" and len(query) >= 3:
+        ids = (await db.execute(
+            text("SELECT rowid FROM users_fts WHERE users_fts MATCH :match ORDER BY rank LIMIT :limit"),
+            {"match": _fts_query(query), "limit": SEARCH_CANDIDATES}
+        )).scalars().all()
+        if not ids:
+            return []
+        return (await db.scalars(select(User).where(User.id.in_(ids), User.is_active == True))).all()
+
+    prefix = f"{_like_escape(query)}%"
+    if _backend == "trigram":
+        relevance = func.greatest(func.similarity(User.username, query), func.similarity(User.full_name, query))
+        statement = select(User).where(
+            or_(User.username.op("%")(query), User.full_name.op("%")(query), User.username.ilike(prefix, escape="\\")),
+            User.is_active == True
+        ).order_by(desc(relevance))
+    else:
+        # Consultas curtas (trigramas exigem 3 caracteres) e fallback em Python
+        contains = f"%{_like_escape(query)}%"
+        statement = select(User).where(
+            or_(User.username.ilike(contains, escape="\\"), User.full_name.ilike(contains, escape="\\")),
+            User.is_active == True
+        )
+    return (await db.scalars(statement.limit(SEARCH_CANDIDATES))).all()
+
+async def find_users(db: AsyncSession, query: str, current_user_id: int, limit: int = 20):
+    candidates = [user for user in await _user_candidates(db, query) if user.id != current_user_id]
+    if not candidates:
+        return []
+
+    # Relação com quem busca, numa consulta só
+    ids = [user.id for user in candidates]
+    edges = (await db.execute(select(followers_table.c.follower_id, followers_table.c.followed_id).where(or_(
+        and_(followers_table.c.follower_id == current_user_id, followers_table.c.followed_id.in_(ids)),
+        and_(followers_table.c.followed_id == current_user_id, followers_table.c.follower_id.in_(ids))
+    )))).all()
+    following = {followed for follower, followed in edges if follower == current_user_id}
+    followers = {follower for follower, followed in edges if followed == current_user_id}
+
+    def score(user: User) -> float:
+        return (
+            text_score(query, user.username, user.full_name)
+            + SEARCH_POPULARITY_WEIGHT * math.log1p(user.followers_count)
+            + (SEARCH_FOLLOWING_BONUS if user.id in following else 0.0)
+            + (SEARCH_FOLLOWER_BONUS if user.id in followers else 0.0)
+        )
+
+    return sorted(candidates, key=score, reverse=True)[:limit]
+
+async def find_hashtags(db: AsyncSession, query: str, limit: int = 20):
+    query = query.lower().lstrip("#")
+    if not query:
+        return []
+
+    if _backend == "fts5" and len(query) >= 3:
+        ids = (await db.execute(
+            text("SELECT rowid FROM hashtags_fts WHERE hashtags_fts MATCH :match ORDER BY rank LIMIT :limit"),
+            {"match": _fts_query(query), "limit": SEARCH_CANDIDATES}
+        )).scalars().all()
+        candidates = (await db.scalars(select(Hashtag).where(Hashtag.id.in_(ids)))).all() if ids else []
+    elif _backend == "trigram":
+        candidates = (await db.scalars(select(Hashtag).where(
+            or_(Hashtag.name.op("%")(query), Hashtag.name.like(f"{_like_escape(query)}%", escape="\\"))
+        ).order_by(desc(func.similarity(Hashtag.name, query))).limit(SEARCH_CANDIDATES))).all()
+    else:
+        # Nomes de hashtag já são minúsculos: LIKE basta, limitado aos mais usados
+        candidates = (await db.scalars(select(Hashtag).where(
+            Hashtag.name.like(f"%{_like_escape(query)}%", escape="\\")
+        ).order_by(desc(Hashtag.posts_count)).limit(SEARCH_CANDIDATES))).all()
+
+    def score(hashtag: Hashtag) -> float:
+        return text_score(query, hashtag.name) + SEARCH_POPULARITY_WEIGHT * math.log1p(hashtag.posts_count)
+
+    return sorted(candidates, key=score, reverse=True)[:limit]
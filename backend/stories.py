@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+from bisect import insort
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models import Story, StoryView
+from cache import TTLCache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Índice das stories ativas na memória do processo: autor -> stories vivas
+# ordenadas pela expiração. A bandeja de stories (/stories/tray) e o feed de
+# stories saem dele sem varrer a tabela stories. O índice é carregado no
+# startup, recebe as stories criadas neste processo na hora, busca as criadas
+# por outros workers a cada STORY_INDEX_REFRESH_SECONDS e descarta as vencidas
+# na leitura. O que cada usuário já viu fica num conjunto compacto por viewer
+# (ids já conferidos e ids vistos, só de stories vivas), completado no banco
+# apenas para as stories que ainda não foram conferidas.
+
+STORY_INDEX_REFRESH_SECONDS = float(os.getenv("STORY_INDEX_REFRESH_SECONDS", "15"))
+STORY_SEEN_CACHE_SIZE = int(os.getenv("STORY_SEEN_CACHE_SIZE", "50000"))
+STORY_SEEN_CACHE_TTL = int(os.getenv("STORY_SEEN_CACHE_TTL", "300"))
+
+class ActiveStories:
+    def __init__(self):
+        self._by_author = {}  # author_id -> [(expires_at, story_id, created_at)]
+        self.ids = set()
+        self.max_id = 0
+        self.loaded = False
+
+    def add(self, story_id: int, author_id: int, created_at: datetime, expires_at: datetime):
+        entries = self._by_author.setdefault(author_id, [])
+        if any(entry[1] == story_id for entry in entries):
+            return
+        insort(entries, (_naive(expires_at), story_id, _naive(created_at)))
+        self.ids.add(story_id)
+        self.max_id = max(self.max_id, story_id)
+
+    def remove(self, story_ids):
+        story_ids = set(story_ids)
+        self.ids -= story_ids
+        for author_id in list(self._by_author):
+            entries = [entry for entry in self._by_author[author_id] if entry[1] not in story_ids]
+            if entries:
+                self._by_author[author_id] = entries
+            else:
+                del self._by_author[author_id]
+
+    def live(self, author_id: int, now: datetime = None):
+        """Stories vivas do autor, (story_id, created_at) da mais antiga para a mais nova"""
+        entries = self._by_author.get(author_id)
+        if not entries:
+            return []
+        now = now or datetime.utcnow()
+        # Ordenadas pela expiração: as vencidas estão no começo
+        expired = 0
+        while expired < len(entries) and entries[expired][0] <= now:
+            expired += 1
+        if expired:
+            self.ids.difference_update(entry[1] for entry in entries[:expired])
+            del entries[:expired]
+            if not entries:
+                del self._by_author[author_id]
+                return []
+        return sorted((story_id, created_at) for _, story_id, created_at in entries)
+
+    def stats(self):
+        return {
+            "authors": len(self._by_author),
+            "stories": sum(len(entries) for entries in self._by_author.values()),
+        }
+
+def _naive(moment: datetime) -> datetime:
+    # SQLite devolve datetimes sem fuso; as comparações usam UTC sem tzinfo
+    return moment.replace(tzinfo=None) if moment and moment.tzinfo else moment
+
+active_stories = ActiveStories()
+seen_cache = TTLCache(maxsize=STORY_SEEN_CACHE_SIZE, ttl=STORY_SEEN_CACHE_TTL)
+
+def add_story(story: Story):
+    active_stories.add(story.id, story.author_id, story.created_at, story.expires_at)
+
+async def load_active_stories(db: AsyncSession, after_id: int = 0):
+    """Carrega as stories vivas com id > after_id (tudo no startup, só as novas depois)"""
+    rows = (await db.execute(
+        select(Story.id, Story.author_id, Story.created_at, Story.expires_at).where(
+            Story.id > after_id,
+            Story.expires_at > datetime.utcnow(),
+            Story.is_active == True
+        )
+    )).all()
+    for story_id, author_id, created_at, expires_at in rows:
+        active_stories.add(story_id, author_id, created_at, expires_at)
+    if not after_id:
+        active_stories.loaded = True
+
+async def ensure_active_stories():
+    """Carga inicial, caso uma requisição chegue antes do refresher"""
+    if not active_stories.loaded:
+        async with AsyncSessionLocal() as db:
+            await load_active_stories(db)
+
+def live_story_ids(author_ids, now: datetime = None):
+    now = now or datetime.utcnow()
+    return [story_id for author_id in author_ids for story_id, _ in active_stories.live(author_id, now)]
+
+async def seen_story_ids(db: AsyncSession, viewer_id: int, story_ids) -> set:
+    """Quais das stories o viewer já viu; consulta o banco só para ids ainda não conferidos"""
+    if not story_ids:
+        return set()
+    checked, seen = seen_cache.get(viewer_id, (frozenset(), frozenset()))
+    unchecked = [story_id for story_id in story_ids if story_id not in checked]
+    if unchecked:
+        # Índice story_views(story_id, viewer_id): uma busca por story
+        seen = seen | set(await db.scalars(select(StoryView.story_id).where(
+            StoryView.story_id.in_(unchecked),
+            StoryView.viewer_id == viewer_id
+        )))
+        # Só stories vivas ficam no conjunto, para ele continuar pequeno
+        checked = frozenset(story_id for story_id in checked | set(story_ids) if _is_live(story_id))
+        seen = frozenset(story_id for story_id in seen if _is_live(story_id))
+        seen_cache.set(viewer_id, (checked, seen))
+    return seen & set(story_ids)
+
+def _is_live(story_id: int) -> bool:
+    # Ids acima de max_id são de outro worker e ainda não chegaram ao índice
+    return story_id in active_stories.ids or story_id > active_stories.max_id
+
+def mark_seen(viewer_id: int, story_id: int):
+    """Chamado por view_story depois do commit"""
+    cached = seen_cache.get(viewer_id)
+    if cached is not None:
+        seen_cache.set(viewer_id, (cached[0] | {story_id}, cached[1] | {story_id}))
+
+def story_tray(author_ids, viewer_id: int, seen: set, now: datetime = None):
+    """Um item por autor com stories vivas: não vistas primeiro, o próprio usuário no início"""
+    now = now or datetime.utcnow()
+    tray = []
+    for author_id in author_ids:
+        stories = active_stories.live(author_id, now)
+        if not stories:
+            continue
+        story_ids = [story_id for story_id, _ in stories]
+        tray.append({
+            "author_id": author_id,
+            "story_ids": story_ids,
+            "has_unseen": any(story_id not in seen for story_id in story_ids),
+            "latest_story_at": stories[-1][1],
+        })
+    tray.sort(key=lambda item: item["latest_story_at"], reverse=True)
+    tray.sort(key=lambda item: (item["author_id"] != viewer_id, not item["has_unseen"]))
+    return tray
+
+async def run_story_index_refresher():
+    """Laço iniciado no startup: carga inicial e depois só as stories novas"""
+    await ensure_active_stories()
+    while True:
+        await asyncio.sleep(STORY_INDEX_REFRESH_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                await load_active_stories(db, active_stories.max_id)
+        except Exception:
+            logger.exception("Falha ao atualizar o índice de stories")
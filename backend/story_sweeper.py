@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, insert
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from database import SessionLocal
+from models import Story, StoryView, ArchivedStory, ArchivedStoryView, MediaBlob
+from media import reclaim_blobs
+from uploads import UPLOAD_DIR, MEDIA_DIR
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Limpeza das stories expiradas, em lotes de STORY_SWEEP_BATCH_SIZE:
+#   1. is_active = False nas stories vencidas (somem das consultas na hora)
+#   2. depois de STORY_ARCHIVE_DELAY_HOURS, a story e suas visualizações vão para
+#      archived_stories / archived_story_views e saem das tabelas quentes
+#   3. a imagem perde a referência; sem outras, o arquivo e os derivados são
+#      apagados (ou movidos para STORY_ARCHIVE_MEDIA_DIR)
+# Roda no processo da API a cada STORY_SWEEP_INTERVAL_SECONDS ou por
+# `python story_sweeper.py`, que imprime o relatório do que foi liberado.
+
+STORY_SWEEPER_ENABLED = os.getenv("STORY_SWEEPER_ENABLED", "true").lower() == "true"
+STORY_SWEEP_INTERVAL_SECONDS = float(os.getenv("STORY_SWEEP_INTERVAL_SECONDS", "300"))
+STORY_SWEEP_BATCH_SIZE = int(os.getenv("STORY_SWEEP_BATCH_SIZE", "500"))
+STORY_ARCHIVE_DELAY_HOURS = float(os.getenv("STORY_ARCHIVE_DELAY_HOURS", "24"))
+STORY_ARCHIVE_MEDIA_DIR = os.getenv("STORY_ARCHIVE_MEDIA_DIR", "")  # vazio = apagar
+
+_ARCHIVED_STORY_COLUMNS = ["author_id", "image_url", "text_content", "views_count", "created_at", "expires_at"]
+
+def deactivate_expired(db: Session, now: datetime) -> int:
+    deactivated = 0
+    while True:
+        story_ids = db.scalars(
+            select(Story.id).where(Story.is_active == True, Story.expires_at <= now).limit(STORY_SWEEP_BATCH_SIZE)
+        ).all()
+        if not story_ids:
+            return deactivated
+        db.execute(update(Story).where(Story.id.in_(story_ids)).values(is_active=False).execution_options(synchronize_session=False))
+        db.commit()
+        deactivated += len(story_ids)
+
+def _remove_legacy_file(image_url: str) -> int:
+    """Stories anteriores ao armazenamento por conteúdo (sem blob): o arquivo é só delas"""
+    path = os.path.normpath(image_url.lstrip("/"))
+    if not path.startswith(UPLOAD_DIR + os.sep) or path.startswith(MEDIA_DIR + os.sep) or not os.path.isfile(path):
+        return 0
+    size = os.path.getsize(path)
+    if STORY_ARCHIVE_MEDIA_DIR:
+        target = os.path.join(STORY_ARCHIVE_MEDIA_DIR, os.path.relpath(path, UPLOAD_DIR))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+    else:
+        os.remove(path)
+    return size
+
+def archive_batch(db: Session, cutoff: datetime):
+    """Move um lote de stories vencidas antes de cutoff; retorna o relatório do lote ou None.
+
+    Vários workers (e a CLI) podem varrer ao mesmo tempo: o lote é reivindicado
+    com DELETE ... RETURNING e o arquivo e os refcounts saem só das linhas que
+    esta transação de fato apagou; quem chegar depois recebe zero linhas.
+    """
+    candidate_ids = db.scalars(
+        select(Story.id).where(Story.expires_at <= cutoff).order_by(Story.id).limit(STORY_SWEEP_BATCH_SIZE)
+    ).all()
+    if not candidate_ids:
+        return None
+
+    # Visualizações antes das stories (chave estrangeira story_views -> stories)
+    views = db.execute(
+        delete(StoryView).where(StoryView.story_id.in_(candidate_ids))
+        .returning(StoryView.story_id, StoryView.viewer_id, StoryView.viewed_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+    stories = db.execute(
+        delete(Story).where(Story.id.in_(candidate_ids), Story.expires_at <= cutoff)
+        .returning(Story.id, Story.blob_id, *(getattr(Story, column) for column in _ARCHIVED_STORY_COLUMNS))
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    archived_ids = {}
+    if stories:
+        archived_ids = dict(db.execute(
+            insert(ArchivedStory).values([
+                {"story_id": story.id, **{column: getattr(story, column) for column in _ARCHIVED_STORY_COLUMNS}}
+                for story in stories
+            ]).returning(ArchivedStory.story_id, ArchivedStory.id)
+        ).all())
+    archived_views = [
+        {"archived_story_id": archived_ids[view.story_id], "viewer_id": view.viewer_id, "viewed_at": view.viewed_at}
+        for view in views if view.story_id in archived_ids
+    ]
+    if archived_views:
+        db.execute(insert(ArchivedStoryView), archived_views)
+
+    references = Counter(story.blob_id for story in stories if story.blob_id)
+    for blob_id, count in references.items():
+        db.execute(update(MediaBlob).where(MediaBlob.id == blob_id).values(refcount=MediaBlob.refcount - count))
+    db.commit()
+
+    report = reclaim_blobs(db, references.keys(), STORY_ARCHIVE_MEDIA_DIR)
+    for story in stories:
+        if not story.blob_id:
+            size = _remove_legacy_file(story.image_url)
+            if size:
+                report["files_removed"] += 1
+                report["bytes_reclaimed"] += size
+    report.update(
+        story_ids=[story.id for story in stories], stories_archived=len(stories), views_archived=len(archived_views)
+    )
+    return report
+
+def sweep_stories(db: Session) -> dict:
+    now = datetime.utcnow()
+    totals = Counter(stories_deactivated=deactivate_expired(db, now))
+    archived_ids = []
+    cutoff = now - timedelta(hours=STORY_ARCHIVE_DELAY_HOURS)
+    while True:
+        report = archive_batch(db, cutoff)
+        if report is None:
+            break
+        archived_ids += report.pop("story_ids")
+        totals.update(report)
+    for key in ("stories_archived", "views_archived", "blobs_removed", "files_removed", "bytes_reclaimed"):
+        totals.setdefault(key, 0)
+    return {**totals, "archived_story_ids": archived_ids}
+
+def _sweep_once() -> dict:
+    db = SessionLocal()
+    try:
+        return sweep_stories(db)
+    finally:
+        db.close()
+
+async def run_story_sweeper(on_archived=None):
+    """Laço iniciado no startup da aplicação; on_archived recebe os ids arquivados"""
+    while True:
+        try:
+            report = await asyncio.to_thread(_sweep_once)
+            archived_ids = report.pop("archived_story_ids")
+            if on_archived and archived_ids:
+                on_archived(archived_ids)
+            if report["stories_deactivated"] or report["stories_archived"]:
+                logger.info("Stories: %s", report)
+        except Exception:
+            logger.exception("Falha ao limpar stories expiradas")
+        await asyncio.sleep(STORY_SWEEP_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    report = _sweep_once()
+    report.pop("archived_story_ids")
+    for name, value in report.items():
+        print(f"{name}: {value}")
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+from sqlalchemy import delete, func, insert, literal, select, tuple_, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models import User, Post, TimelineEntry, followers_table
+from feed import following_ids_subquery
+from pagination import paginate
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Timeline materializada (fan-out on write).
+# Quando habilitada, create_post grava o ID do post na timeline de cada seguidor
+# (e do próprio autor), e o feed vira uma leitura por faixa no índice
+# (user_id, created_at, post_id). Autores com muitos seguidores ("celebridades")
+# não fazem fan-out: os posts deles são buscados na leitura e mesclados.
+# O corte em TIMELINE_MAX_ENTRIES é feito fora do create_post, por um laço a
+# cada FEED_TIMELINE_TRIM_SECONDS. Ao habilitar o modo num banco existente,
+# `python timeline.py` reconstrói as timelines (uma vez, com a API parada); o
+# feed só lê a timeline e nunca a reconstrói.
+
+TIMELINE_ENABLED = os.getenv("FEED_TIMELINE_ENABLED", "false").lower() == "true"
+TIMELINE_MAX_ENTRIES = int(os.getenv("FEED_TIMELINE_MAX_ENTRIES", "800"))
+CELEBRITY_FOLLOWER_THRESHOLD = int(os.getenv("FEED_CELEBRITY_FOLLOWER_THRESHOLD", "10000"))
+TIMELINE_TRIM_SECONDS = float(os.getenv("FEED_TIMELINE_TRIM_SECONDS", "60"))
+
+async def is_celebrity(db: AsyncSession, author_id: int) -> bool:
+    followers_count = await db.scalar(select(User.followers_count).where(User.id == author_id))
+    return (followers_count or 0) > CELEBRITY_FOLLOWER_THRESHOLD
+
+def celebrity_authors_subquery(user_id: int):
+    """IDs dos autores acompanhados pelo usuário (incluindo ele mesmo) que não fazem fan-out"""
+    followed = union_all(
+        following_ids_subquery(user_id),
+        select(literal(user_id))
+    ).subquery()
+    return select(User.id).where(
+        User.id.in_(select(followed.c[0])),
+        User.followers_count > CELEBRITY_FOLLOWER_THRESHOLD
+    )
+
+async def _trim_timelines(db: AsyncSession, user_ids) -> int:
+    """Mantém apenas as TIMELINE_MAX_ENTRIES entradas mais recentes de cada timeline.
+
+    Uma passada por timeline (ROW_NUMBER por usuário), em vez de procurar o
+    corte de novo para cada entrada.
+    """
+    ranked = select(
+        TimelineEntry.user_id,
+        TimelineEntry.post_id,
+        func.row_number().over(partition_by=TimelineEntry.user_id, order_by=TimelineEntry.post_id.desc()).label("position")
+    ).where(TimelineEntry.user_id.in_(user_ids)).subquery()
+    excess = select(ranked.c.user_id, ranked.c.post_id).where(ranked.c.position > TIMELINE_MAX_ENTRIES)
+
+    result = await db.execute(delete(TimelineEntry).where(
+        tuple_(TimelineEntry.user_id, TimelineEntry.post_id).in_(excess)
+    ).execution_options(synchronize_session=False))
+    return result.rowcount
+
+async def trim_timelines(db: AsyncSession) -> int:
+    """Corta só as timelines acima do limite; retorna quantas entradas saíram"""
+    over_limit = select(TimelineEntry.user_id).group_by(TimelineEntry.user_id).having(
+        func.count() > TIMELINE_MAX_ENTRIES
+    )
+    removed = await _trim_timelines(db, over_limit)
+    await db.commit()
+    return removed
+
+async def fan_out_post(db: AsyncSession, post: Post):
+    """Insere o post na timeline do autor e de todos os seguidores com um único INSERT ... SELECT"""
+    if not TIMELINE_ENABLED or await is_celebrity(db, post.author_id):
+        return
+
+    recipients = union_all(
+        select(followers_table.c.follower_id).where(followers_table.c.followed_id == post.author_id),
+        select(literal(post.author_id))
+    ).subquery()
+
+    await db.execute(insert(TimelineEntry).from_select(
+        ["user_id", "post_id", "author_id", "created_at"],
+        select(recipients.c[0], Post.id, Post.author_id, Post.created_at).where(Post.id == post.id)
+    ))
+
+async def backfill_timeline(db: AsyncSession, user_id: int, author_id: int):
+    """Copia os posts recentes de um autor recém-seguido para a timeline do seguidor"""
+    if not TIMELINE_ENABLED or await is_celebrity(db, author_id):
+        return
+
+    already = select(TimelineEntry.post_id).where(TimelineEntry.user_id == user_id)
+    recent = select(
+        literal(user_id), Post.id, Post.author_id, Post.created_at
+    ).where(
+        Post.author_id == author_id,
+        Post.id.not_in(already)
+    ).order_by(Post.id.desc()).limit(TIMELINE_MAX_ENTRIES)
+
+    await db.execute(insert(TimelineEntry).from_select(
+        ["user_id", "post_id", "author_id", "created_at"], recent
+    ))
+    await _trim_timelines(db, [user_id])
+
+async def prune_timeline(db: AsyncSession, user_id: int, author_id: int):
+    """Remove da timeline do usuário os posts de um autor que deixou de seguir"""
+    if not TIMELINE_ENABLED:
+        return
+
+    await db.execute(delete(TimelineEntry).where(
+        TimelineEntry.user_id == user_id,
+        TimelineEntry.author_id == author_id
+    ).execution_options(synchronize_session=False))
+
+async def rebuild_timeline(db: AsyncSession, user_id: int):
+    """Reconstrói a timeline de um usuário do zero (ex.: ao habilitar o modo materializado)"""
+    await db.execute(delete(TimelineEntry).where(
+        TimelineEntry.user_id == user_id
+    ).execution_options(synchronize_session=False))
+
+    authors = union_all(
+        following_ids_subquery(user_id),
+        select(literal(user_id))
+    ).subquery()
+    recent = select(
+        literal(user_id), Post.id, Post.author_id, Post.created_at
+    ).join(User, User.id == Post.author_id).where(
+        Post.author_id.in_(select(authors.c[0])),
+        func.coalesce(User.followers_count, 0) <= CELEBRITY_FOLLOWER_THRESHOLD
+    ).order_by(Post.id.desc()).limit(TIMELINE_MAX_ENTRIES)
+
+    await db.execute(insert(TimelineEntry).from_select(
+        ["user_id", "post_id", "author_id", "created_at"], recent
+    ))
+
+async def timeline_page_ids(db: AsyncSession, user_id: int, skip: int, limit: int, cursor: Optional[str] = None):
+    """IDs da página do feed: leitura por faixa na timeline mesclada com os posts de celebridades"""
+    window = limit if cursor else skip + limit
+
+    timeline_query = select(TimelineEntry.post_id, TimelineEntry.created_at).where(
+        TimelineEntry.user_id == user_id
+    )
+    timeline_rows = (await db.execute(
+        paginate(timeline_query, TimelineEntry, 0, window, cursor, id_column=TimelineEntry.post_id)
+    )).all()
+
+    celebrity_query = select(Post.id, Post.created_at).where(
+        Post.author_id.in_(celebrity_authors_subquery(user_id))
+    )
+    celebrity_rows = (await db.execute(paginate(celebrity_query, Post, 0, window, cursor))).all()
+
+    merged = {post_id: created_at for post_id, created_at in timeline_rows}
+    merged.update({post_id: created_at for post_id, created_at in celebrity_rows})
+    ordered = sorted(merged, key=lambda post_id: (merged[post_id], post_id), reverse=True)
+
+    if not cursor:
+        ordered = ordered[skip:]
+    return ordered[:limit]
+
+async def run_timeline_trimmer():
+    """Laço iniciado no startup da aplicação (só com FEED_TIMELINE_ENABLED)"""
+    while True:
+        await asyncio.sleep(TIMELINE_TRIM_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                await trim_timelines(db)
+        except Exception:
+            logger.exception("Falha ao cortar as timelines")
+
+async def rebuild_all_timelines() -> int:
+    async with AsyncSessionLocal() as db:
+        user_ids = list(await db.scalars(select(User.id).order_by(User.id)))
+        for user_id in user_ids:
+            await rebuild_timeline(db, user_id)
+            await db.commit()
+    return len(user_ids)
+
+if __name__ == "__main__":
+    print(f"Timelines reconstruídas: {asyncio.run(rebuild_all_timelines())}")
@@ -0,0 +1,117 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal, dialect_insert
+from models import Hashtag, HashtagActivity
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Hashtags em alta. sync_post_hashtags registra cada uso numa janela de
+# TRENDING_BUCKET_MINUTES (hashtag_activity, um upsert por post). O refresher
+# soma as janelas das últimas TRENDING_WINDOW_HOURS com peso que cai pela metade
+# a cada TRENDING_HALF_LIFE_MINUTES (uma velocidade com decaimento exponencial),
+# escolhe o top-k com um heap e guarda o resultado em memória: /hashtags/trending
+# só fatia a lista pronta. Janelas fora do período são apagadas no refresh.
+
+TRENDING_BUCKET_MINUTES = int(os.getenv("TRENDING_BUCKET_MINUTES", "5"))
+TRENDING_WINDOW_HOURS = int(os.getenv("TRENDING_WINDOW_HOURS", "24"))
+TRENDING_HALF_LIFE_MINUTES = float(os.getenv("TRENDING_HALF_LIFE_MINUTES", "120"))
+TRENDING_TOP_K = int(os.getenv("TRENDING_TOP_K", "50"))
+TRENDING_REFRESH_SECONDS = float(os.getenv("TRENDING_REFRESH_SECONDS", "60"))
+
+_snapshot = []
+_refreshed_at = None
+
+def bucket_start(moment: datetime) -> datetime:
+    moment = moment.replace(second=0, microsecond=0)
+    return moment - timedelta(minutes=moment.minute % TRENDING_BUCKET_MINUTES)
+
+async def record_hashtag_activity(db: AsyncSession, hashtag_ids):
+    """Conta um uso de cada hashtag na janela atual (upsert, na transação do chamador)"""
+    if not hashtag_ids:
+        return
+    insert = dialect_insert(db)
+    bucket = bucket_start(datetime.utcnow())
+    statement = insert(HashtagActivity).values([
+        {"hashtag_id": hashtag_id, "bucket_start": bucket, "count": 1} for hashtag_id in hashtag_ids
+    ])
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[HashtagActivity.hashtag_id, HashtagActivity.bucket_start],
+        set_={"count": HashtagActivity.count + statement.excluded.count}
+    ))
+
+def decayed_scores(rows, now: datetime) -> dict:
+    """Soma de (hashtag_id, bucket_start, count) com peso 2^(-idade / meia-vida)"""
+    half_life = TRENDING_HALF_LIFE_MINUTES * 60
+    scores = defaultdict(float)
+    for hashtag_id, start, count in rows:
+        # A idade é medida do fim da janela: a janela atual vale peso cheio
+        age = max(0.0, (now - start).total_seconds() - TRENDING_BUCKET_MINUTES * 60)
+        scores[hashtag_id] += count * 0.5 ** (age / half_life)
+    return scores
+
+def _item(hashtag: Hashtag, score: float) -> dict:
+    return {
+        "id": hashtag.id,
+        "name": hashtag.name,
+        "posts_count": hashtag.posts_count or 0,
+        "created_at": hashtag.created_at,
+        "score": round(score, 4),
+    }
+
+async def refresh_trending(db: AsyncSession):
+    """Recalcula o top-k e troca o snapshot"""
+    global _snapshot, _refreshed_at
+    now = datetime.utcnow()
+    since = bucket_start(now - timedelta(hours=TRENDING_WINDOW_HOURS))
+    await db.execute(delete(HashtagActivity).where(HashtagActivity.bucket_start < since))
+    await db.commit()
+
+    rows = (await db.execute(
+        select(HashtagActivity.hashtag_id, HashtagActivity.bucket_start, HashtagActivity.count)
+    )).all()
+    scores = decayed_scores(rows, now)
+    top = heapq.nlargest(TRENDING_TOP_K, scores.items(), key=lambda item: item[1])
+
+    hashtags = {}
+    if top:
+        hashtags = {h.id: h for h in (await db.scalars(select(Hashtag).where(Hashtag.id.in_([i for i, _ in top])))).all()}
+    snapshot = [_item(hashtags[hashtag_id], score) for hashtag_id, score in top if hashtag_id in hashtags]
+
+    # Sem atividade suficiente no período (ex.: instalação nova), completa com as mais usadas
+    if len(snapshot) < TRENDING_TOP_K:
+        seen = [item["id"] for item in snapshot]
+        filler = (await db.scalars(
+            select(Hashtag).where(Hashtag.posts_count > 0, Hashtag.id.not_in(seen))
+            .order_by(desc(Hashtag.posts_count)).limit(TRENDING_TOP_K - len(snapshot))
+        )).all()
+        snapshot += [_item(hashtag, 0.0) for hashtag in filler]
+
+    _snapshot = snapshot
+    _refreshed_at = time.time()
+
+async def trending(limit: int):
+    """Top-k atual; calcula na hora só se o refresher ainda não rodou neste processo"""
+    if _refreshed_at is None:
+        async with AsyncSessionLocal() as db:
+            await refresh_trending(db)
+    return _snapshot[:max(0, limit)]
+
+async def run_trending_refresher():
+    """Laço iniciado no startup da aplicação"""
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                await refresh_trending(db)
+        except Exception:
+            logger.exception("Falha ao atualizar hashtags em alta")
+        await asyncio.sleep(TRENDING_REFRESH_SECONDS)
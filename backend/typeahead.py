@@ -0,0 +1,257 @@
+import asyncio
+import gzip
+import heapq
+import json
+import logging
+import os
+import time
+from bisect import bisect_left, insort
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+from database import AsyncSessionLocal
+from models import User, Hashtag
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Autocomplete da busca (/search/typeahead) servido da memória do processo, sem
+# ir ao banco a cada tecla. Um índice por tipo (usuários e hashtags), ordenado
+# por popularidade (seguidores / posts). Ciclo de vida:
+#   startup  - carrega o snapshot (TYPEAHEAD_SNAPSHOT_PATH) se for recente e
+#              busca só as linhas criadas depois; senão reconstrói do banco
+#   register / process_hashtags - atualizam o índice deste processo na hora
+#   refresher - a cada TYPEAHEAD_REFRESH_SECONDS busca linhas novas (criadas por
+#              outros workers) e a cada TYPEAHEAD_REBUILD_SECONDS reconstrói
+#              tudo, atualizando os pesos e gravando um novo snapshot
+# `python typeahead.py` reconstrói o snapshot manualmente.
+
+TYPEAHEAD_TOP_K = int(os.getenv("TYPEAHEAD_TOP_K", "10"))
+TYPEAHEAD_PREFIX_DEPTH = int(os.getenv("TYPEAHEAD_PREFIX_DEPTH", "4"))
+TYPEAHEAD_SCAN_LIMIT = int(os.getenv("TYPEAHEAD_SCAN_LIMIT", "2000"))
+TYPEAHEAD_REFRESH_SECONDS = float(os.getenv("TYPEAHEAD_REFRESH_SECONDS", "30"))
+TYPEAHEAD_REBUILD_SECONDS = float(os.getenv("TYPEAHEAD_REBUILD_SECONDS", "3600"))
+TYPEAHEAD_SNAPSHOT_PATH = os.getenv("TYPEAHEAD_SNAPSHOT_PATH", "typeahead_snapshot.json.gz")
+TYPEAHEAD_SNAPSHOT_VERSION = 2
+
+class PrefixIndex:
+    """Top-k por prefixo.
+
+    Prefixos de até TYPEAHEAD_PREFIX_DEPTH caracteres (os digitados primeiro e
+    com mais candidatos) têm o top-k pré-calculado, como os nós de uma trie.
+    Prefixos mais longos fazem busca binária na lista ordenada de termos e
+    percorrem o intervalo, que nesse ponto já é pequeno. Os termos de uma entrada
+    não mudam depois de inseridos; só o peso é atualizado.
+    """
+
+    def __init__(self, top_k: int = TYPEAHEAD_TOP_K, depth: int = TYPEAHEAD_PREFIX_DEPTH):
+        self.top_k = top_k
+        self.depth = depth
+        self.entries = {}  # id -> (peso, item, termos)
+        self.terms = []    # (termo, id), ordenada
+        self.top = {}      # prefixo -> ids, do maior para o menor peso
+        self.max_id = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _prefixes(self, terms):
+        return {term[:size] for term in terms for size in range(1, min(len(term), self.depth) + 1)}
+
+    def _weight(self, entry_id: int):
+        return self.entries[entry_id][0]
+
+    def _offer(self, prefix: str, entry_id: int, weight: int):
+        ids = self.top.setdefault(prefix, [])
+        if entry_id in ids:
+            ids.remove(entry_id)
+        elif len(ids) >= self.top_k and weight <= self._weight(ids[-1]):
+            return
+        position = next((i for i, other in enumerate(ids) if self._weight(other) < weight), len(ids))
+        ids.insert(position, entry_id)
+        del ids[self.top_k:]
+
+    def add(self, entry_id: int, terms, weight: int, item: dict):
+        """Insere a entrada ou atualiza seu peso.
+
+        Um peso menor mantém a entrada nos prefixos onde já está até a próxima
+        reconstrução, quando os pesos são recalculados do banco.
+        """
+        previous = self.entries.get(entry_id)
+        terms = previous[2] if previous else tuple(dict.fromkeys(term.lower() for term in terms if term))
+        self.entries[entry_id] = (weight, item, terms)
+        if not previous:
+            for term in terms:
+                insort(self.terms, (term, entry_id))
+        for prefix in self._prefixes(terms):
+            self._offer(prefix, entry_id, weight)
+        self.max_id = max(self.max_id, entry_id)
+
+    def load(self, rows):
+        """Construção em lote a partir de (id, termos, peso, item)"""
+        rows = sorted(rows, key=lambda row: row[2], reverse=True)
+        for entry_id, terms, weight, item in rows:
+            terms = tuple(dict.fromkeys(term.lower() for term in terms if term))
+            self.entries[entry_id] = (weight, item, terms)
+            self.terms.extend((term, entry_id) for term in terms)
+            # Em ordem decrescente de peso basta completar as listas
+            for prefix in self._prefixes(terms):
+                ids = self.top.setdefault(prefix, [])
+                if len(ids) < self.top_k:
+                    ids.append(entry_id)
+            self.max_id = max(self.max_id, entry_id)
+        self.terms.sort()
+
+    def complete(self, prefix: str, limit: int = TYPEAHEAD_TOP_K, exclude=None):
+        """Até limit entradas com um termo começando por prefix, sem a entrada exclude"""
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+        if len(prefix) <= self.depth:
+            ids = [entry_id for entry_id in self.top.get(prefix, []) if entry_id != exclude][:limit]
+        else:
+            found = set()
+            start = bisect_left(self.terms, (prefix,))
+            for position in range(start, min(start + TYPEAHEAD_SCAN_LIMIT, len(self.terms))):
+                term, entry_id = self.terms[position]
+                if not term.startswith(prefix):
+                    break
+                found.add(entry_id)
+            found.discard(exclude)
+            ids = heapq.nlargest(limit, found, key=self._weight)
+        return [self.entries[entry_id][1] for entry_id in ids]
+
+    def rows(self):
+        return [(entry_id, terms, weight, item) for entry_id, (weight, item, terms) in self.entries.items()]
+
+class Typeahead:
+    def __init__(self):
+        # Uma posição a mais por prefixo: o próprio usuário é retirado da resposta
+        self.users = PrefixIndex(top_k=TYPEAHEAD_TOP_K + 1)
+        self.hashtags = PrefixIndex()
+        self.built_at = 0.0
+
+typeahead = Typeahead()
+
+def user_row(user):
+    item = {"id": user.id, "username": user.username, "full_name": user.full_name, "profile_picture": user.profile_picture or ""}
+    # Nome completo inteiro ("bob s") e cada palavra dele ("smith")
+    full_name = user.full_name or ""
+    return user.id, (user.username, full_name, *full_name.split()), user.followers_count or 0, item
+
+def hashtag_row(hashtag):
+    item = {"id": hashtag.id, "name": hashtag.name, "posts_count": hashtag.posts_count or 0}
+    return hashtag.id, (hashtag.name,), hashtag.posts_count or 0, item
+
+def add_user(user: User):
+    typeahead.users.add(*user_row(user))
+
+def add_hashtag(hashtag: Hashtag):
+    typeahead.hashtags.add(*hashtag_row(hashtag))
+
+def complete(query: str, limit: int = TYPEAHEAD_TOP_K, kind: str = "all", user_id: int = None):
+    """Completa usuários e/ou hashtags; '@' restringe a usuários e '#' a hashtags.
+
+    user_id (quem digita) fica fora dos usuários sugeridos.
+    """
+    query = query.strip()
+    if query.startswith("@"):
+        query, kind = query[1:], "users"
+    elif query.startswith("#"):
+        query, kind = query[1:], "hashtags"
+    limit = max(1, min(limit, TYPEAHEAD_TOP_K))
+    return {
+        "users": typeahead.users.complete(query, limit, exclude=user_id) if kind in ("all", "users") else [],
+        "hashtags": typeahead.hashtags.complete(query, limit) if kind in ("all", "hashtags") else [],
+    }
+
+_USER_COLUMNS = (User.id, User.username, User.full_name, User.profile_picture, User.followers_count)
+_HASHTAG_COLUMNS = (Hashtag.id, Hashtag.name, Hashtag.posts_count)
+
+async def _fetch_rows(db: AsyncSession, users_after: int = 0, hashtags_after: int = 0):
+    users = (await db.execute(
+        select(*_USER_COLUMNS).where(User.id > users_after, User.is_active == True)
+    )).all()
+    hashtags = (await db.execute(select(*_HASHTAG_COLUMNS).where(Hashtag.id > hashtags_after))).all()
+    return [user_row(user) for user in users], [hashtag_row(hashtag) for hashtag in hashtags]
+
+def _build(user_rows, hashtag_rows) -> Typeahead:
+    index = Typeahead()
+    index.users.load(user_rows)
+    index.hashtags.load(hashtag_rows)
+    index.built_at = time.time()
+    return index
+
+async def rebuild(db: AsyncSession):
+    """Reconstrói do banco fora do event loop e troca o índice de uma vez"""
+    global typeahead
+    user_rows, hashtag_rows = await _fetch_rows(db)
+    typeahead = await asyncio.to_thread(_build, user_rows, hashtag_rows)
+
+async def catch_up(db: AsyncSession):
+    """Acrescenta usuários e hashtags criados depois do último id conhecido"""
+    user_rows, hashtag_rows = await _fetch_rows(db, typeahead.users.max_id, typeahead.hashtags.max_id)
+    for row in user_rows:
+        typeahead.users.add(*row)
+    for row in hashtag_rows:
+        typeahead.hashtags.add(*row)
+
+def save_snapshot(path: str = TYPEAHEAD_SNAPSHOT_PATH):
+    snapshot = {
+        "version": TYPEAHEAD_SNAPSHOT_VERSION,
+        "built_at": typeahead.built_at,
+        "users": typeahead.users.rows(),
+        "hashtags": typeahead.hashtags.rows(),
+    }
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    with gzip.open(temp_path, "wt", encoding="utf-8") as file:
+        json.dump(snapshot, file, separators=(",", ":"))
+    os.replace(temp_path, path)
+
+def load_snapshot(path: str = TYPEAHEAD_SNAPSHOT_PATH) -> bool:
+    """Carrega o snapshot se existir, for desta versão e mais novo que TYPEAHEAD_REBUILD_SECONDS"""
+    global typeahead
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            snapshot = json.load(file)
+    except (OSError, ValueError):
+        return False
+    if snapshot.get("version") != TYPEAHEAD_SNAPSHOT_VERSION or time.time() - snapshot["built_at"] > TYPEAHEAD_REBUILD_SECONDS:
+        return False
+    index = _build(snapshot["users"], snapshot["hashtags"])
+    index.built_at = snapshot["built_at"]
+    typeahead = index
+    return True
+
+async def warm_up():
+    """Startup: snapshot recente + linhas novas, ou reconstrução completa"""
+    async with AsyncSessionLocal() as db:
+        if await asyncio.to_thread(load_snapshot):
+            await catch_up(db)
+        else:
+            await rebuild(db)
+            await asyncio.to_thread(save_snapshot)
+
+async def run_refresher():
+    """Laço iniciado no startup da aplicação"""
+    while True:
+        await asyncio.sleep(TYPEAHEAD_REFRESH_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                if time.time() - typeahead.built_at >= TYPEAHEAD_REBUILD_SECONDS:
+                    await rebuild(db)
+                    await asyncio.to_thread(save_snapshot)
+                else:
+                    await catch_up(db)
+        except Exception:
+            logger.exception("Falha ao atualizar o índice de autocomplete")
+
+if __name__ == "__main__":
+    async def main():
+        async with AsyncSessionLocal() as db:
+            await rebuild(db)
+        save_snapshot()
+        print(f"Snapshot {TYPEAHEAD_SNAPSHOT_PATH}: {len(typeahead.users)} usuários, {len(typeahead.hashtags)} hashtags")
+
+    asyncio.run(main())
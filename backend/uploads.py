@@ -0,0 +1,201 @@
+import hashlib
+import os
+import uuid
+from dataclasses import dataclass
+from fastapi import HTTPException, UploadFile
+from PIL import Image, ImageOps
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Gravação de uploads em disco: lê o arquivo em blocos de tamanho fixo, escreve
+# e calcula o hash fora do event loop, aplica o limite de bytes por tipo durante
+# a cópia e grava num arquivo temporário renomeado atomicamente ao final.
+# A cópia parte do arquivo temporário em que o Starlette já gravou o multipart:
+# o corpo inteiro é lido antes do endpoint. Por isso UploadSizeLimitMiddleware
+# recusa com 413, pelo Content-Length e antes de ler o corpo, requisições
+# multipart maiores que MAX_UPLOAD_REQUEST_BYTES (o maior limite por tipo mais
+# folga para os outros campos); o limite por tipo continua valendo por arquivo.
+# O nome final é o sha256 do conteúdo (uploads/media/ab/cd/<sha256>.<ext>), então
+# o mesmo arquivo enviado duas vezes ocupa o disco uma única vez, mesmo com outra
+# extensão: vale o arquivo que já existe (e o caminho já gravado no MediaBlob).
+# Imagens com EXIF/XMP (GPS, câmera) são regravadas sem os metadados antes do
+# hash: o original servido em image_url nunca os carrega.
+
+UPLOAD_DIR = "uploads"
+MEDIA_DIR = os.path.join(UPLOAD_DIR, "media")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+MAX_UPLOAD_BYTES = {
+    "image": int(os.getenv("MAX_IMAGE_UPLOAD_BYTES", str(20 * 1024 * 1024))),
+    "video": int(os.getenv("MAX_VIDEO_UPLOAD_BYTES", str(200 * 1024 * 1024))),
+}
+
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv(
+    "MAX_UPLOAD_REQUEST_BYTES", str(max(MAX_UPLOAD_BYTES.values()) + 1024 * 1024)
+))
+
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
+
+# Metadados removidos das imagens enviadas; GIFs e imagens animadas ficam como vieram
+IMAGE_METADATA_KEYS = ['exif', 'xmp', 'XML:com.adobe.xmp', 'photoshop', 'comment']
+STRIPPABLE_FORMATS = ['JPEG', 'PNG', 'WEBP']
+EXIF_ORIENTATION = 0x0112
+VIDEO_EXTENSIONS = ['mp4', 'mov', 'avi', 'mkv', 'webm']
+
+@dataclass
+class StoredUpload:
+    path: str
+    url: str
+    size: int
+    sha256: str
+    created: bool  # False quando o conteúdo já existia em disco
+
+class UploadSizeLimitMiddleware:
+    """Recusa uploads multipart grandes demais antes de o corpo ser lido"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            length = headers.get("content-length", "")
+            if (headers.get("content-type", "").startswith("multipart/form-data")
+                    and length.isdigit() and int(length) > MAX_UPLOAD_REQUEST_BYTES):
+                response = JSONResponse(
+                    {"detail": f"Upload too large (max {MAX_UPLOAD_REQUEST_BYTES // (1024 * 1024)}MB)"},
+                    status_code=413,
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+def file_extension(upload: UploadFile) -> str:
+    return upload.filename.split(".")[-1].lower()
+
+def _open_temp(path: str):
+    return open(path, "wb")
+
+def _write_chunk(buffer, hasher, chunk: bytes):
+    # hashlib e write liberam o GIL para blocos grandes
+    hasher.update(chunk)
+    buffer.write(chunk)
+
+def media_path(sha256: str, extension: str) -> str:
+    """Caminho endereçado pelo conteúdo, dividido em diretórios pelo prefixo do hash"""
+    return os.path.join(MEDIA_DIR, sha256[:2], sha256[2:4], f"{sha256}.{extension}")
+
+def existing_media_path(sha256: str):
+    """Arquivo original já gravado para o hash, com qualquer extensão (derivados têm sufixo _)"""
+    directory = os.path.dirname(media_path(sha256, ""))
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return None
+    for name in names:
+        if os.path.splitext(name)[0] == sha256:
+            return os.path.join(directory, name)
+    return None
+
+def media_url(path: str) -> str:
+    return "/" + path.replace(os.sep, "/")
+
+def _close_temp(buffer):
+    buffer.flush()
+    os.fsync(buffer.fileno())
+    buffer.close()
+
+def strip_image_metadata(path: str) -> bool:
+    """Regrava a imagem sem EXIF/XMP, já na orientação do EXIF; False se não havia o que tirar"""
+    try:
+        image = Image.open(path)
+    except (OSError, Image.DecompressionBombError):
+        return False  # Não é uma imagem que o Pillow abre: fica como veio
+    clean_path = f"{path}.clean"
+    with image:
+        if (image.format not in STRIPPABLE_FORMATS or getattr(image, "n_frames", 1) > 1
+                or not any(key in image.info for key in IMAGE_METADATA_KEYS)):
+            return False
+        options = {"icc_profile": image.info.get("icc_profile")}
+        if image.format == "JPEG" and image.getexif().get(EXIF_ORIENTATION, 1) == 1:
+            # Mesmas tabelas de quantização do original: sem perda visível
+            clean, options["quality"] = image, "keep"
+        else:
+            clean = ImageOps.exif_transpose(image)
+            if image.format != "PNG":
+                options["quality"] = 95
+        # O Pillow só grava exif/xmp quando recebe o parâmetro
+        try:
+            clean.save(clean_path, image.format, **options)
+        except BaseException:
+            if os.path.exists(clean_path):
+                os.remove(clean_path)
+            raise
+    os.replace(clean_path, path)
+    return True
+
+def _hash_file(path: str):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest(), os.path.getsize(path)
+
+def _finish(temp_path: str, sha256: str, extension: str):
+    """Caminho final do conteúdo e se o arquivo foi criado agora"""
+    existing = existing_media_path(sha256)
+    if existing:
+        # Conteúdo duplicado: descarta a cópia e renova o mtime (protege do coletor em media.py)
+        os.remove(temp_path)
+        os.utime(existing)
+        return existing, False
+    final_path = media_path(sha256, extension)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(temp_path, final_path)
+    return final_path, True
+
+def _discard(buffer, temp_path: str):
+    buffer.close()
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+def _too_large(kind: str) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"{kind.capitalize()} too large (max {MAX_UPLOAD_BYTES[kind] // (1024 * 1024)}MB)"
+    )
+
+async def save_upload(upload: UploadFile, kind: str = "image") -> StoredUpload:
+    """Copia o upload para o armazenamento endereçado pelo conteúdo, sem bloquear o event loop"""
+    limit = MAX_UPLOAD_BYTES[kind]
+    if upload.size is not None and upload.size > limit:
+        raise _too_large(kind)
+
+    temp_path = os.path.join(UPLOAD_DIR, f".tmp-{uuid.uuid4().hex}")
+    hasher = hashlib.sha256()
+    size = 0
+
+    buffer = await run_in_threadpool(_open_temp, temp_path)
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise _too_large(kind)
+            await run_in_threadpool(_write_chunk, buffer, hasher, chunk)
+        sha256 = hasher.hexdigest()
+        await run_in_threadpool(_close_temp, buffer)
+        if kind == "image" and await run_in_threadpool(strip_image_metadata, temp_path):
+            sha256, size = await run_in_threadpool(_hash_file, temp_path)
+        final_path, created = await run_in_threadpool(_finish, temp_path, sha256, file_extension(upload))
+    except BaseException:
+        await run_in_threadpool(_discard, buffer, temp_path)
+        raise
+
+    return StoredUpload(path=final_path, url=media_url(final_path), size=size, sha256=sha256, created=created)
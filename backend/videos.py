@@ -0,0 +1,162 @@
+import logging
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from database import SessionLocal
+from models import Post, PostVideo, VideoJob, MediaBlob
+from uploads import media_url
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Pós-processamento de vídeo: create_post grava o vídeo, cria um VideoJob por
+# PostVideo e responde com o post em status "processing". O worker
+# (`python videos.py`, ou `--once` para esvaziar a fila e sair) consome a tabela,
+# usa ffprobe/ffmpeg para obter duração e poster, e marca o post como "ready"
+# quando não restam jobs dele. Falhas são repetidas com espera exponencial.
+
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+VIDEO_JOB_MAX_ATTEMPTS = int(os.getenv("VIDEO_JOB_MAX_ATTEMPTS", "5"))
+VIDEO_JOB_RETRY_DELAY_SECONDS = int(os.getenv("VIDEO_JOB_RETRY_DELAY_SECONDS", "30"))
+VIDEO_JOB_TIMEOUT_SECONDS = int(os.getenv("VIDEO_JOB_TIMEOUT_SECONDS", "120"))
+VIDEO_WORKER_POLL_SECONDS = float(os.getenv("VIDEO_WORKER_POLL_SECONDS", "2"))
+VIDEO_POSTER_MAX_WIDTH = int(os.getenv("VIDEO_POSTER_MAX_WIDTH", "1080"))
+
+def enqueue_video_jobs(db: AsyncSession, post: Post, post_videos):
+    """Cria os jobs na mesma transação do post (PostVideo já com id, após flush)"""
+    if post_videos:
+        post.status = "processing"
+    for post_video in post_videos:
+        db.add(VideoJob(post_id=post.id, post_video_id=post_video.id))
+
+def poster_path(path: str) -> str:
+    # Mesmo prefixo sha256 do vídeo: o coletor de media.py mantém o poster junto
+    return f"{os.path.splitext(path)[0]}_poster.jpg"
+
+def probe_duration(path: str) -> int:
+    result = subprocess.run(
+        [FFPROBE_BIN, "-v", "error", "-show_entries", "format=duration",
+         "-of", "default=noprint_wrappers=1:nokey=1", path],
+        capture_output=True, text=True, check=True, timeout=VIDEO_JOB_TIMEOUT_SECONDS
+    )
+    return round(float(result.stdout.strip()))
+
+def extract_poster(path: str, duration: int) -> str:
+    poster = poster_path(path)
+    if not os.path.exists(poster):
+        temp_path = f"{poster}.tmp-{os.getpid()}"
+        subprocess.run(
+            [FFMPEG_BIN, "-y", "-v", "error", "-ss", str(min(1, duration / 2)), "-i", path,
+             "-frames:v", "1", "-vf", f"scale='min({VIDEO_POSTER_MAX_WIDTH},iw)':-2",
+             "-q:v", "3", "-f", "image2", temp_path],
+            capture_output=True, check=True, timeout=VIDEO_JOB_TIMEOUT_SECONDS
+        )
+        os.replace(temp_path, poster)
+    return poster
+
+def _claim_next_job(db: Session):
+    """Reserva o próximo job pendente; o UPDATE condicional evita que dois workers peguem o mesmo"""
+    now = datetime.utcnow()
+    candidates = db.scalars(
+        select(VideoJob.id).where(VideoJob.status == "pending", VideoJob.run_after <= now)
+        .order_by(VideoJob.run_after, VideoJob.id).limit(10)
+    ).all()
+    for job_id in candidates:
+        claimed = db.execute(
+            update(VideoJob).where(VideoJob.id == job_id, VideoJob.status == "pending")
+            .values(status="running", attempts=VideoJob.attempts + 1, updated_at=now)
+        ).rowcount
+        db.commit()
+        if claimed:
+            return db.get(VideoJob, job_id)
+    return None
+
+def _requeue_stale_jobs(db: Session):
+    """Jobs em running há mais que o timeout pertencem a um worker que morreu.
+
+    Voltam para a fila, exceto os que já esgotaram as tentativas (um vídeo que
+    derruba o worker não é reprocessado para sempre): esses falham e liberam o post.
+    """
+    now = datetime.utcnow()
+    stale = (VideoJob.status == "running", VideoJob.updated_at < now - timedelta(seconds=VIDEO_JOB_TIMEOUT_SECONDS * 2))
+    failed_posts = db.scalars(
+        update(VideoJob).where(*stale, VideoJob.attempts >= VIDEO_JOB_MAX_ATTEMPTS)
+        .values(status="failed", last_error="worker interrompido durante o job", updated_at=now)
+        .returning(VideoJob.post_id)
+    ).all()
+    requeued = db.execute(
+        update(VideoJob).where(*stale).values(status="pending")
+    ).rowcount
+    for post_id in set(failed_posts):
+        _finish_post_if_done(db, post_id)
+    db.commit()
+    if failed_posts or requeued:
+        logger.info("Jobs de vídeo abandonados: %d de volta à fila, %d falharam", requeued, len(failed_posts))
+
+def _finish_post_if_done(db: Session, post_id: int):
+    remaining = select(VideoJob.id).where(VideoJob.post_id == post_id, VideoJob.status.in_(["pending", "running"]))
+    db.execute(update(Post).where(Post.id == post_id, ~exists(remaining)).values(status="ready"))
+
+def process_job(db: Session, job: VideoJob):
+    path = db.scalar(
+        select(MediaBlob.path).join(PostVideo, PostVideo.blob_id == MediaBlob.id)
+        .where(PostVideo.id == job.post_video_id)
+    )
+    try:
+        if not path:
+            raise FileNotFoundError(f"PostVideo {job.post_video_id} sem arquivo de mídia")
+        duration = probe_duration(path)
+        poster = extract_poster(path, duration)
+    except Exception as error:
+        if job.attempts >= VIDEO_JOB_MAX_ATTEMPTS:
+            job.status = "failed"
+        else:
+            job.status = "pending"
+            job.run_after = datetime.utcnow() + timedelta(seconds=VIDEO_JOB_RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1))
+        job.last_error = str(error)[:1000]
+    else:
+        db.execute(
+            update(PostVideo).where(PostVideo.id == job.post_video_id)
+            .values(thumbnail_url=media_url(poster), duration=duration)
+        )
+        job.status = "done"
+        job.last_error = None
+
+    job.updated_at = datetime.utcnow()
+    db.flush()
+    # Um job que esgotou as tentativas também libera o post: o vídeo continua tocando, só sem poster
+    _finish_post_if_done(db, job.post_id)
+    db.commit()
+    return job.status
+
+def run_worker(once: bool = False):
+    db = SessionLocal()
+    try:
+        while True:
+            try:
+                _requeue_stale_jobs(db)
+                job = _claim_next_job(db)
+                if job:
+                    logger.info("Job de vídeo %d (post %d): %s", job.id, job.post_id, process_job(db, job))
+                    continue
+            except Exception:
+                # Erro do banco: o job em running volta à fila por _requeue_stale_jobs
+                logger.exception("Falha no worker de vídeo")
+                db.rollback()
+            if once:
+                return
+            time.sleep(VIDEO_WORKER_POLL_SECONDS)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    run_worker(once="--once" in sys.argv)
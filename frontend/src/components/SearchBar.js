@@ -32,8 +32,8 @@ function SearchBar() {
       setLoading(true);
       timeoutRef.current = setTimeout(async () => {
         try {
-          const response = await searchAPI.searchUsers(query.trim());
-          setResults(response.data);
+          const response = await searchAPI.typeahead(query.trim(), 'users');
+          setResults(response.data.users);
           setIsOpen(true);
         } catch (error) {
           console.error('Error searching users:', error);
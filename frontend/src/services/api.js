@@ -87,6 +87,7 @@ export const notificationsAPI = {
 export const searchAPI = {
   searchUsers: (query, limit = 20) => api.get(`/search/users?q=${encodeURIComponent(query)}&limit=${limit}`),
   searchHashtags: (query, limit = 20) => api.get(`/search/hashtags?q=${encodeURIComponent(query)}&limit=${limit}`),
+  typeahead: (query, kind = 'all', limit = 10) => api.get(`/search/typeahead?q=${encodeURIComponent(query)}&kind=${kind}&limit=${limit}`),
 };
 
 // Hashtags API